@@ -1,36 +1,87 @@
 import json
+import os
+import sys
 import numpy as np
-from typing import Dict, List
+from typing import Dict
 import matplotlib.pyplot as plt
 
+from storage import TrainingLog
+
 
 def load_data(filename: str) -> dict:
-    """load training results and compute max_score."""
-    with open(f"data/{filename}.json", "r") as f:
-        training_state = json.load(f)
-    max_reached = 0
-    training_state['max_scores'] = []
-    for i in training_state['scores']:
-        max_reached = max(i, max_reached)
-        training_state['max_scores'].append(max_reached)
-    return training_state
-
-
-def plot_performance(agent_states: Dict[str, List], window=50, xlim=None, ylim=None, logy=False) -> None:
-    """Plot the training performance."""
+    """
+    load training results and compute max_score.
+    :param filename: name in the data directory, data/<filename>.bin is read as a training log through a memory map and
+    data/<filename>.json as training values
+    :return: dict of episodes, scores and max_scores arrays, the episodes of a training log are counted in the order
+    they ended rather than by the numbers they were played with
+    """
+    if os.path.exists(f"data/{filename}.bin"):
+        records, _ = TrainingLog.read(f"data/{filename}.bin")
+        episodes, scores = np.arange(1, len(records) + 1), records['score']
+    else:
+        with open(f"data/{filename}.json", "r") as f:
+            training_state = json.load(f)
+        episodes, scores = np.asarray(training_state['episodes']), np.asarray(training_state['scores'])
+    return {'episodes': episodes, 'scores': scores, 'max_scores': np.maximum.accumulate(scores)}
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean over a window centred on each value from a cumulative sum, the windows at the ends are cut short.
+    :param values: values to average
+    :param window: number of values in each window
+    :return: float64 array of the rolling mean, as long as values
+    """
+    sums = np.zeros(len(values) + 1)
+    np.cumsum(values, dtype=np.float64, out=sums[1:])
+    index = np.arange(len(values))
+    start = np.maximum(index - window // 2, 0)
+    end = np.minimum(index - window // 2 + window, len(values))
+    return (sums[end] - sums[start]) / (end - start)
+
+
+def downsample(x: np.ndarray, y: np.ndarray, buckets: int):
+    """
+    Keep the min and max of y in each of buckets runs of consecutive points, so a plot one bucket per pixel wide looks
+    the same as plotting every point.
+    :param x: sorted x values
+    :param y: y values
+    :param buckets: number of buckets, the width of the plot in pixels
+    :return: (x, y) with the min then the max of each bucket, at the first and last x of the bucket
+    """
+    if len(y) <= 2 * buckets:
+        return np.asarray(x), np.asarray(y)
+    edges = np.linspace(0, len(y), buckets + 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:] - 1
+    x_out = np.stack((x[starts], x[ends]), axis=1).ravel()
+    y_out = np.stack((np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)), axis=1).ravel()
+    return x_out, y_out
+
+
+def plot_performance(agent_states: Dict[str, np.ndarray], window=50, xlim=None, ylim=None, logy=False) -> None:
+    """Plot the training performance, downsampled to the width of the figure in pixels."""
     episodes, scores, max_scores = agent_states['episodes'], agent_states['scores'], agent_states['max_scores']
+    if xlim:
+        # only the episodes in view are averaged and downsampled, so zooming in shows every episode again
+        start, end = np.searchsorted(episodes, xlim[0]), np.searchsorted(episodes, xlim[1], side='right')
+        episodes, scores, max_scores = episodes[start:end], scores[start:end], max_scores[start:end]
+    mean_scores = rolling_mean(scores, window)
     fig, ax = plt.subplots()
+    buckets = int(np.ceil(fig.get_size_inches()[0] * fig.dpi))
     plt.ylabel('Score', fontsize=16)
     plt.xlabel('Episode', fontsize=16)
+    offset = 0
     if logy:
         ax.set_yscale('log')
         plt.ylabel('log(Score)', fontsize=14)
-        scores = [x+1 for x in scores]
-        max_scores = [x+1 for x in max_scores]
-    plt.scatter(episodes, scores, label='scores', color='b', s=3)
-    plt.plot(episodes, max_scores, label='max_score', color='g')
-    plt.plot(episodes, np.convolve(scores, np.ones((window,)) / window, mode='same'),
-             label='rolling_mean_score', color='orange')
+        offset = 1
+    x, y = downsample(episodes, scores, buckets)
+    plt.scatter(x, y + offset, label='scores', color='b', s=3)
+    x, y = downsample(episodes, max_scores, buckets)
+    plt.plot(x, y + offset, label='max_score', color='g')
+    x, y = downsample(episodes, mean_scores, buckets)
+    plt.plot(x, y + offset, label='rolling_mean_score', color='orange')
     if xlim:
         plt.xlim(xlim)
     if ylim:
@@ -43,6 +94,7 @@ def plot_performance(agent_states: Dict[str, List], window=50, xlim=None, ylim=N
 
 
 if __name__ == '__main__':
-    filename = 'validation_resume'
+    # Plot data/<name>.bin or data/<name>.json, e.g. python analysis.py training_log 1000
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'validation_resume'
     agent_performance = load_data(filename)
-    plot_performance(agent_performance, window=3, logy=True)
+    plot_performance(agent_performance, window=int(sys.argv[2]) if len(sys.argv) > 2 else 3, logy=True)
@@ -0,0 +1,46 @@
+import json
+import sys
+
+from benchmarks.suite import compare, run
+from storage import save_json
+
+RESULTS_PATH = "benchmarks/results.json"
+BASELINE_PATH = "benchmarks/baseline.json"
+
+USAGE = """Run from the repository root:
+  python -m benchmarks run [output] [scale]           run every benchmark, default output benchmarks/results.json
+  python -m benchmarks compare [current] [baseline] [tolerance]
+                                                      flag results more than tolerance (default 0.1) worse than the
+                                                      baseline, default benchmarks/results.json against
+                                                      benchmarks/baseline.json, exits 1 on a regression
+Copy a results file to benchmarks/baseline.json to store it as the baseline."""
+
+
+def main(args):
+    command = args[0] if args else "run"
+    if command == "run":
+        output = args[1] if len(args) > 1 else RESULTS_PATH
+        results = run(float(args[2]) if len(args) > 2 else 1.0)
+        for name, result in results['results'].items():
+            print(f"{name:<60}{result['value']:>16,.6g} {result['unit']}")
+        save_json(output, results)
+        print(f"Saved results to {output}")
+    elif command == "compare":
+        with open(args[1] if len(args) > 1 else RESULTS_PATH) as f:
+            current = json.load(f)
+        with open(args[2] if len(args) > 2 else BASELINE_PATH) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, current, float(args[3]) if len(args) > 3 else 0.1)
+        for name, base, value, change, regressed in rows:
+            print(f"{name:<60}{base:>14,.6g}{value:>14,.6g}{change:>+9.1%}{'  REGRESSION' if regressed else ''}")
+        regressions = sum(row[4] for row in rows)
+        print(f"{regressions} regression{'' if regressions == 1 else 's'} out of {len(rows)} benchmarks")
+        return 1 if regressions else 0
+    else:
+        print(USAGE)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,185 @@
+import glob
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from flappy_env import FlappyEnv, PIPEGAPSIZE, PIPE_HEIGHT, PIPE_WIDTH, PLAYER_HEIGHT, PLAYER_WIDTH, BASEY, \
+    episode_rng
+from q_learning import QLearning
+from storage import load_json_qtable, load_qtable, save_qtable
+
+SEED = 2021  # every benchmark plays the same pipes
+
+
+def best_time(function, repeat=5):
+    """
+    Time a function, taking the fastest of a few runs to leave out noise from the rest of the machine.
+    :param function: function without arguments
+    :param repeat: number of runs
+    :return: seconds of the fastest run
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def rate(count, seconds, unit):
+    """Result of count operations in seconds, higher is better."""
+    return {'value': count / seconds, 'unit': unit, 'higher_is_better': True}
+
+
+def duration(seconds):
+    """Result of a duration, lower is better."""
+    return {'value': seconds, 'unit': 's', 'higher_is_better': False}
+
+
+def play(agent, frames, on_frame=None):
+    """
+    Play the agent for a number of frames, starting a new episode on every crash.
+    :param agent: QLearning agent
+    :param frames: number of frames
+    :param on_frame: called with the environment before the agent acts on each frame
+    """
+    env = FlappyEnv(episode_rng(SEED, 0))
+    env.reset()
+    episode = 0
+    for _ in range(frames):
+        if on_frame is not None:
+            on_frame(env)
+        action = agent.act(env.player_x, env.player_y, env.player_vel_y, env.lower_pipes)
+        if env.step(action)[0][0]:
+            episode += 1
+            env.reset(rng=episode_rng(SEED, episode))
+
+
+def bench_simulation(agent, frames=100000):
+    """Frames per second of the headless game loop of mainGame, the agent acting and the environment stepping."""
+    return rate(frames, best_time(lambda: play(agent, frames), repeat=3), 'frames/s')
+
+
+def bench_get_state(agent, frames=100000):
+    """get_state calls per second on the inputs of a recorded game, with the state cache warm."""
+    inputs = []
+    play(agent, frames, lambda env: inputs.append((env.player_x, env.player_y, env.player_vel_y,
+                                                   [dict(pipe) for pipe in env.lower_pipes])))
+    get_state = agent.get_state
+
+    def run():
+        for x, y, vel, pipe in inputs:
+            get_state(x, y, vel, pipe)
+    return rate(len(inputs), best_time(run), 'calls/s')
+
+
+def bench_check_crash():
+    """check_crash calls per second over a grid of bird offsets around a pipe pair."""
+    env = FlappyEnv(episode_rng(SEED, 0))
+    env.reset()
+    gap_y = int(BASEY * 0.2) + 100
+    offsets = [(dx, dy) for dx in range(-PIPE_WIDTH - 4, PLAYER_WIDTH + 4)
+               for dy in range(-PLAYER_HEIGHT - 8, PIPEGAPSIZE + 8)]
+
+    def run():
+        for dx, dy in offsets:
+            env.player_y = gap_y + dy
+            env.upper_pipes = [{'x': env.player_x + dx, 'y': gap_y - PIPE_HEIGHT}]
+            env.lower_pipes = [{'x': env.player_x + dx, 'y': gap_y + PIPEGAPSIZE}]
+            env.check_crash()
+    return rate(len(offsets), best_time(run), 'calls/s')
+
+
+def bench_update_qvalues(agent, moves=500000):
+    """Moves per second of update_qvalues over a recorded long trajectory, each run updates a copy of it."""
+    agent.moves.clear()
+    play(agent, moves)
+    recorded = agent.moves.copy()
+    agent.moves.clear()
+    copies = [recorded.copy() for _ in range(3)]
+    return rate(len(recorded), best_time(lambda: agent.update_qvalues(0, copies.pop()), repeat=3), 'moves/s')
+
+
+def bench_persistence(directory="data"):
+    """Seconds to import, save and load each json Q-table shipped in the data directory."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in sorted(glob.glob(os.path.join(directory, "q_values*.json"))):
+            name = os.path.splitext(os.path.basename(path))[0]
+            qtable_path = os.path.join(tmp, name + ".qtable")
+            qtable = load_json_qtable(path)
+            results[f"load_json.{name}"] = duration(best_time(lambda: load_json_qtable(path), repeat=3))
+            # saving and loading a binary table take around a millisecond, more runs leave out more noise
+            results[f"save_qtable.{name}"] = duration(best_time(lambda: save_qtable(qtable_path, *qtable), repeat=20))
+            results[f"load_qtable.{name}"] = duration(best_time(lambda: [np.array(a) for a in load_qtable(qtable_path)],
+                                                                repeat=20))
+    return results
+
+
+STARTUP = """
+import sys
+from flappy_env import FlappyEnv, preload_hitmasks
+from q_learning import QLearning
+preload_hitmasks()
+agent, env = QLearning(False), FlappyEnv()
+env.reset()
+env.step(agent.act(env.player_x, env.player_y, env.player_vel_y, env.lower_pipes))
+sys.exit('pygame' in sys.modules)
+"""
+
+
+def bench_startup():
+    """Seconds from starting a new interpreter to the first headless frame, which must not import pygame."""
+    def start():
+        if subprocess.run([sys.executable, "-c", STARTUP], stdout=subprocess.DEVNULL).returncode:
+            raise RuntimeError("The headless modules imported pygame")
+    start()  # the first start may import the json Q-table and save the hitmasks
+    return duration(best_time(start, repeat=3))
+
+
+def run(scale=1.0):
+    """
+    Run every benchmark headless, from the repository root.
+    :param scale: multiply the frames and moves of each benchmark, lower for a quick check
+    :return: {'machine': ..., 'results': {name: {'value', 'unit', 'higher_is_better'}}}
+    """
+    results = {}
+    # the agents play the shipped Q-table, the trained one is never saved and doesn't open the training log
+    agent = QLearning(False)
+    trainer = QLearning(True, seed=SEED, log_path=None)
+    results['startup'] = bench_startup()
+    results['simulation'] = bench_simulation(agent, int(100000 * scale))
+    results['get_state'] = bench_get_state(agent, int(100000 * scale))
+    results['check_crash'] = bench_check_crash()
+    results['update_qvalues'] = bench_update_qvalues(trainer, int(500000 * scale))
+    results.update(bench_persistence())
+    machine = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+               'processor': platform.processor(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'machine': machine, 'results': results}
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Compare results with a baseline.
+    :param baseline: results of run() to compare against
+    :param current: results of run()
+    :param tolerance: fraction a result may be worse than the baseline before it is a regression
+    :return: list of (name, baseline value, current value, change, regressed), change is the fraction better (+) or
+    worse (-) than the baseline
+    """
+    rows = []
+    for name, base in baseline['results'].items():
+        result = current['results'].get(name)
+        if result is None:
+            continue
+        if base['higher_is_better']:
+            change = result['value'] / base['value'] - 1
+        else:
+            change = base['value'] / result['value'] - 1
+        rows.append((name, base['value'], result['value'], change, change < -tolerance))
+    return rows
@@ -0,0 +1,141 @@
+import time
+
+STARTED = time.perf_counter()  # before any of the game is imported, for the time to the first frame
+
+import argparse
+import subprocess
+import sys
+
+from config import config
+
+USAGE = """Examples, run from the repository root:
+  python cli.py train --workers 8 --episodes 100000   train headless over worker processes
+  python cli.py train --game --watch                  train in the game, drawing the latest frame at 30 fps
+  python cli.py run                                   watch the trained agent play
+  python cli.py evaluate --episodes 100 --budget 600  score distribution of the trained agent
+  python cli.py bench run                             benchmarks, see python -m benchmarks help
+  python cli.py dashboard                             live learning curves of the training log, in its own process
+  python cli.py compact --min-visits 2                evict rarely visited states that don't change the policy
+Only the modes with a window (run, train --game) import pygame."""
+
+
+def train(args):
+    """Train headless with parallel.train, or in the game with --game."""
+    if args.dashboard:
+        subprocess.Popen([sys.executable, __file__, "dashboard"])
+    if args.game:
+        return play(args, train=True)
+    from parallel import train as train_parallel
+    train_parallel(args.workers, args.episodes, args.batch_size, seed=args.seed)
+
+
+def play(args, train=False):
+    """Run the game of flappy_rl, showing every frame or with --watch only the latest frame at display rate."""
+    config['train'] = train
+    config['show_game'], config['watch'] = not args.watch, args.watch
+    import flappy_rl
+    flappy_rl.main(STARTED)
+
+
+def evaluate(args):
+    """Evaluate the agent headless over a process pool."""
+    from evaluate import evaluate as evaluate_agent
+    evaluate_agent(args.episodes, args.workers, args.seed, args.budget, args.max_score, args.output)
+
+
+def bench(args):
+    """Run or compare the benchmarks."""
+    from benchmarks.__main__ import main as benchmarks_main
+    return benchmarks_main(args.args)
+
+
+def dashboard(args):
+    """Follow the training log, drawing the learning curves or with --text printing them."""
+    from dashboard import main as dashboard_main
+    dashboard_main(args.log, args.interval, args.window, not args.text)
+
+
+def compact(args):
+    """Compact the saved Q-table, see QLearning.compact."""
+    from q_learning import QTABLE_PATH, QLearning
+    from storage import save_qtable
+    agent = QLearning(False)
+    report = agent.compact(args.min_visits, keep_policy=not args.any_action)
+    print(f"Compacted Q-table from {report['states_before']} to {report['states_after']} states, "
+          f"{report['bytes_saved']:,} bytes saved, the policy agrees on {report['policy_agreement']:.2%} of states "
+          f"and {report['visit_agreement']:.2%} of visits")
+    if not args.dry_run:
+        n = len(agent.states)
+        save_qtable(QTABLE_PATH, agent.state_keys[:n], agent.q_values[:n], agent.visits[:n])
+
+
+def parse_args(argv):
+    """
+    Parse the command line.
+    :param argv: arguments without the program name
+    :return: argparse Namespace, command is the function to run with it
+    """
+    parser = argparse.ArgumentParser(description="Train, run, evaluate or benchmark the Flappy Bird Q-learning agent.",
+                                     epilog=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="mode", required=True)
+
+    parser_train = commands.add_parser("train", help="train headless over worker processes, or in the game with --game")
+    parser_train.add_argument("--game", action="store_true", help="train in the game loop of flappy_rl.py")
+    parser_train.add_argument("--watch", action="store_true",
+                              help="with --game run uncapped and only draw the latest frame at 30 fps")
+    parser_train.add_argument("--workers", type=int, help="worker processes, default the number of CPUs")
+    parser_train.add_argument("--episodes", type=int, help="stop after this many episodes, default until ctrl+c")
+    parser_train.add_argument("--batch-size", type=int, default=256, help="birds each worker simulates at once")
+    parser_train.add_argument("--dashboard", action="store_true", help="open the dashboard in a process of its own")
+    parser_train.set_defaults(command=train)
+
+    parser_run = commands.add_parser("run", help="watch the trained agent play")
+    parser_run.add_argument("--watch", action="store_true",
+                            help="run uncapped and only draw the latest frame at 30 fps")
+    parser_run.set_defaults(command=play)
+
+    parser_evaluate = commands.add_parser("evaluate", help="score distribution of the trained agent, headless")
+    parser_evaluate.add_argument("--episodes", type=int, default=25, help="episodes to play")
+    parser_evaluate.add_argument("--workers", type=int, help="worker processes, default the number of CPUs")
+    parser_evaluate.add_argument("--budget", type=float, help="stop after this many seconds")
+    parser_evaluate.add_argument("--max-score", type=int, help="end an episode at this score, default from config.py")
+    parser_evaluate.add_argument("--output", help="save the scores to this json file")
+    parser_evaluate.set_defaults(command=evaluate)
+
+    parser_bench = commands.add_parser("bench", help="run or compare the benchmarks, headless")
+    parser_bench.add_argument("args", nargs=argparse.REMAINDER, help="arguments of python -m benchmarks")
+    parser_bench.set_defaults(command=bench)
+
+    parser_dashboard = commands.add_parser("dashboard", help="live learning curves of the training log")
+    parser_dashboard.add_argument("--log", default="data/training_log.bin", help="training log to follow")
+    parser_dashboard.add_argument("--interval", type=float, default=1.0, help="seconds between reading the log")
+    parser_dashboard.add_argument("--window", type=int, default=1000, help="episodes of the rolling mean score")
+    parser_dashboard.add_argument("--text", action="store_true", help="print a line per update rather than plot")
+    parser_dashboard.set_defaults(command=dashboard)
+
+    parser_compact = commands.add_parser("compact", help="evict rarely visited states from the saved Q-table")
+    parser_compact.add_argument("--min-visits", type=int, default=2, help="evict states visited fewer times")
+    parser_compact.add_argument("--any-action", action="store_true",
+                                help="also evict states whose greedy action is to flap, changing the policy")
+    parser_compact.add_argument("--dry-run", action="store_true", help="only report, leave the Q-table as it is")
+    parser_compact.set_defaults(command=compact)
+
+    for subparser in (parser_train, parser_run, parser_evaluate):
+        subparser.add_argument("--seed", type=int, help="run seed for the pipes, default from config.py or the "
+                                                        "training states")
+    for subparser in (parser_train, parser_run):
+        subparser.add_argument("--profile", action="store_true", help="with the game, time each phase of the loop")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if getattr(args, 'seed', None) is not None:
+        config['seed'] = args.seed
+    if getattr(args, 'profile', False):
+        config['profile'] = True
+    return args.command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import random
+
+import numpy as np
+
+from flappy_env import PLAYERS_LIST, PIPES_LIST, PLAYER_WIDTH, PLAYER_HEIGHT, PIPE_WIDTH, PIPE_HEIGHT, \
+    load_bitmask, load_hitmask, pixel_collision
+
+# Offsets (pipe - bird) at which the bird and pipe rects overlap, any other offset can't collide
+DX_MIN, DX_MAX = -(PIPE_WIDTH - 1), PLAYER_WIDTH - 1
+DY_MIN, DY_MAX = -(PIPE_HEIGHT - 1), PLAYER_HEIGHT - 1
+TABLE_PATH = "data/collision_table.npz"
+
+
+def bitmask_array(bitmask, width):
+    """Unpack a bitmask into a (height, width) boolean array."""
+    return np.array([[row >> x & 1 for x in range(width)] for row in bitmask], dtype=bool)
+
+
+class CollisionTable:
+    """
+    Precomputed bird/pipe collisions.
+
+    The bird x is fixed and pipes only move in whole pixels, so whether the bird hits a pipe only depends on the
+    sprites, the bird's flap frame and the offset (pipe_x - playerx, pipe_y - playery). The table holds the result for
+    every offset at which the rects overlap, indexed [player, playerIndex, pipe, lower pipe, dx, dy].
+    """
+    def __init__(self, path=TABLE_PATH, verify=False):
+        """
+        Load the table from file, computing and saving it if missing or built from different sprites.
+        :param path: cache file, None to always compute the table and not save it
+        :param verify: cross-check the table against pixel_collision on load
+        """
+        self.signature = self.get_signature()
+        self.table = None
+        if path:
+            try:
+                with np.load(path) as cache:
+                    if str(cache['signature']) == self.signature:
+                        self.table = cache['table']
+            except (IOError, KeyError, ValueError):
+                pass
+        if self.table is None:
+            print("Computing collision table...")
+            self.table = self.compute()
+            if path:
+                tmp_path = f"{path}.tmp.npz"
+                np.savez_compressed(tmp_path, table=self.table, signature=self.signature)
+                os.replace(tmp_path, path)
+        self.shape = self.table.shape
+        self.flat = self.table.astype(np.uint8).tobytes()  # indexing bytes is much faster than numpy scalars
+        if verify:
+            mismatches = self.verify()
+            if mismatches:
+                raise ValueError(f"Collision table disagrees with pixel_collision at {mismatches} offsets")
+
+    @staticmethod
+    def get_signature():
+        """Hash of the sprite bitmasks the table is computed from."""
+        bitmasks = [load_bitmask(path) for player in PLAYERS_LIST for path in player] + \
+                   [load_bitmask(path, rotate) for path in PIPES_LIST for rotate in (True, False)]
+        return hashlib.sha1(repr(bitmasks).encode()).hexdigest()
+
+    @staticmethod
+    def compute():
+        """
+        Compute the collisions for every sprite, flap frame and overlapping offset.
+        :return: boolean array [player, playerIndex, pipe, lower pipe, dx, dy]
+        """
+        dy = np.arange(DY_MIN, DY_MAX + 1)
+        rows = np.arange(PLAYER_HEIGHT)[:, None]
+        pipe_rows = rows - dy[None, :]  # pipe row level with each bird row, for every dy
+        valid = (pipe_rows >= 0) & (pipe_rows < PIPE_HEIGHT)
+        pipe_rows = np.clip(pipe_rows, 0, PIPE_HEIGHT - 1)
+
+        table = np.zeros((len(PLAYERS_LIST), 3, len(PIPES_LIST), 2, DX_MAX - DX_MIN + 1, len(dy)), dtype=bool)
+        for player, player_paths in enumerate(PLAYERS_LIST):
+            for player_index, player_path in enumerate(player_paths):
+                bird = bitmask_array(load_bitmask(player_path), PLAYER_WIDTH).astype(np.int32)
+                for pipe, pipe_path in enumerate(PIPES_LIST):
+                    for lower, rotate in enumerate((True, False)):
+                        pipe_mask = bitmask_array(load_bitmask(pipe_path, rotate), PIPE_WIDTH).astype(np.int32)
+                        for dx in range(DX_MIN, DX_MAX + 1):
+                            # columns shared by the bird and pipe at this offset
+                            left, right = max(0, dx), min(PLAYER_WIDTH, dx + PIPE_WIDTH)
+                            # overlap[r, s]: bird row r and pipe row s share an opaque column
+                            overlap = bird[:, left:right] @ pipe_mask[:, left - dx:right - dx].T > 0
+                            table[player, player_index, pipe, lower, dx - DX_MIN] = \
+                                (overlap[rows, pipe_rows] & valid).any(axis=0)
+        return table
+
+    def verify(self, samples=200000, rng=None):
+        """
+        Cross-check the table against pixel_collision.
+        :param samples: number of random entries to check, None to check every entry
+        :param rng: random number generator for the samples
+        :return: number of entries that disagree
+        """
+        rng = rng if rng is not None else random.Random()
+        entries = np.ndindex(*self.shape) if samples is None else \
+            (tuple(rng.randrange(size) for size in self.shape) for _ in range(samples))
+        player_hitmasks = [[load_hitmask(path) for path in player] for player in PLAYERS_LIST]
+        pipe_hitmasks = [[load_hitmask(path, rotate) for rotate in (True, False)] for path in PIPES_LIST]
+
+        mismatches = 0
+        for player, player_index, pipe, lower, dx, dy in entries:
+            collided = pixel_collision((0, 0, PLAYER_WIDTH, PLAYER_HEIGHT),
+                                       (dx + DX_MIN, dy + DY_MIN, PIPE_WIDTH, PIPE_HEIGHT),
+                                       player_hitmasks[player][player_index], pipe_hitmasks[pipe][lower])
+            mismatches += collided != self.table[player, player_index, pipe, lower, dx, dy]
+        return mismatches
+
+    def crash(self, player, player_index, pipe, player_x, player_y, pipe_x, upper_y, lower_y):
+        """
+        Check if the bird hits a pipe pair.
+        :param player: index into PLAYERS_LIST
+        :param player_index: flap frame of the bird
+        :param pipe: index into PIPES_LIST
+        :param player_x: bird x
+        :param player_y: bird y
+        :param pipe_x: x of the pipe pair
+        :param upper_y: upper pipe y
+        :param lower_y: lower pipe y
+        :return: True if the bird collides with either pipe
+        """
+        # pygame.Rect truncates coordinates to integers
+        dx = int(pipe_x) - int(player_x)
+        if dx < DX_MIN or dx > DX_MAX:
+            return False
+        player_y = int(player_y)
+        _, frames, pipes, _, n_dx, n_dy = self.shape
+        # flat index of [player, player_index, pipe, upper pipe, dx, 0]
+        base = ((((player * frames + player_index) * pipes + pipe) * 2) * n_dx + dx - DX_MIN) * n_dy - DY_MIN
+        dy = int(upper_y) - player_y
+        if DY_MIN <= dy <= DY_MAX and self.flat[base + dy]:
+            return True
+        dy = int(lower_y) - player_y
+        return DY_MIN <= dy <= DY_MAX and self.flat[base + n_dx * n_dy + dy] == 1
+
+    def crash_batch(self, player, player_index, pipe, player_x, player_y, pipe_x, upper_y, lower_y):
+        """
+        Vectorised crash for a batch of birds, see BatchFlappyEnv.
+        :param player: array of indices into PLAYERS_LIST
+        :param player_index: array of flap frames
+        :param pipe: array of indices into PIPES_LIST
+        :param player_x: bird x, shared by all birds
+        :param player_y: array of bird y
+        :param pipe_x: (n, pipes) array of pipe x, empty slots are inf
+        :param upper_y: (n, pipes) array of upper pipe y
+        :param lower_y: (n, pipes) array of lower pipe y
+        :return: boolean array, True if the bird collides with any pipe
+        """
+        dx = np.trunc(pipe_x) - int(player_x)
+        level = (dx >= DX_MIN) & (dx <= DX_MAX)
+        dx = np.where(level, dx, DX_MIN).astype(np.int64) - DX_MIN
+        player_top = np.trunc(player_y).astype(np.int64)[:, None]
+        index = (player[:, None], player_index[:, None], pipe[:, None])
+
+        crashed = np.zeros(len(player_y), dtype=bool)
+        for lower, pipe_y in enumerate((upper_y, lower_y)):
+            dy = pipe_y - player_top
+            hit = level & (dy >= DY_MIN) & (dy <= DY_MAX)
+            hit &= self.table[index + (lower, dx, np.clip(dy, DY_MIN, DY_MAX) - DY_MIN)]
+            crashed |= hit.any(axis=1)
+        return crashed
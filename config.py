@@ -1,6 +1,19 @@
 config = {'train': False,  # train or run the model
           'show_game': True,  # when training/evaluating it is much faster to not display the game graphics
+          'watch': False,  # with show_game off, still draw the latest frame at 30 fps while the game runs uncapped
           'print_score': 10000,  # print when a multiple of this score is reached
           'max_score': 10000000,  # end the episode and update q-table when reaching this score
           'resume_score': 100000,  # if dies above this score, resume training from this difficult segment
+          'spill_moves': 1000000,  # moves of an episode kept in memory before spilling to disk, None to update them early
+          'replay_bytes': 256 * 2 ** 20,  # bytes of failed attempts kept for replay, the oldest are evicted first
+          'seed': None,  # run seed for the pipes of every episode, None to carry on with the saved seed or pick one
+          'collision_table': False,  # look up collisions in a table precomputed for every bird/pipe offset
+          'hitmask_cache': True,  # save the sprite hitmasks to data/hitmasks.npz rather than decode the pngs every run
+          'checkpoint_episodes': 10000,  # when training save a checkpoint every this many episodes, None to disable
+          'checkpoint_seconds': 600,  # and/or every this many seconds, checkpoints are written in the background
+          'checkpoint_keep': 3,  # number of checkpoints kept in data/checkpoints
+          'compact_visits': None,  # when training evict states visited fewer times whose greedy action is do nothing
+          'compact_episodes': 10000,  # every this many episodes, between episodes, see QLearning.compact
+          'profile': False,  # time each phase of the game loop, printed and saved to data/profile.json on exit
+          'profile_episodes': 100,  # number of recent episodes the rolling profile is over
           }
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from storage import TRAINING_LOG_DTYPE, TRAINING_LOG_HEADER, TrainingLog
+
+
+class LogTail:
+    """
+    Reader of the records appended to a training log since the last read, the log is never read twice.
+
+    Only whole records are read, a record still being written is read on the next call. If the log shrinks, because
+    training resumed from an earlier index or started a new log, it is read again from the start.
+    """
+    def __init__(self, path="data/training_log.bin"):
+        """
+        Initialise the reader, the log doesn't need to exist yet
+        :param path: training log file
+        """
+        self.path = path
+        self.file = None
+        self.records = 0  # records read
+
+    def read(self, limit=2 ** 20):
+        """
+        Read the new records.
+        :param limit: most records read at once, the rest are read by the next calls
+        :return: (TRAINING_LOG_DTYPE records, restarted), restarted when the log was read again from the start
+        """
+        restarted = False
+        if self.file is None:
+            if not os.path.exists(self.path):
+                return np.zeros(0, dtype=TRAINING_LOG_DTYPE), restarted
+            self.file = open(self.path, "rb")
+            TrainingLog.check_header(self.file.read(TRAINING_LOG_HEADER.size), self.path)
+        records = (os.fstat(self.file.fileno()).st_size - TRAINING_LOG_HEADER.size) // TRAINING_LOG_DTYPE.itemsize
+        if records < self.records:
+            self.records, restarted = 0, True
+        self.file.seek(TRAINING_LOG_HEADER.size + self.records * TRAINING_LOG_DTYPE.itemsize)
+        data = self.file.read(min(records - self.records, limit) * TRAINING_LOG_DTYPE.itemsize)
+        new = np.frombuffer(data, dtype=TRAINING_LOG_DTYPE, count=len(data) // TRAINING_LOG_DTYPE.itemsize)
+        self.records += len(new)
+        return new, restarted
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class LiveStats:
+    """
+    Learning curves of a training log built up from its new records, in a fixed number of points.
+
+    Episodes are summed into buckets of equal size. When the buckets run out, neighbouring buckets are merged and the
+    bucket size doubles, so adding records costs the number of records and the curves never grow past the capacity.
+    """
+    def __init__(self, points=1024, window=1000):
+        """
+        Initialise empty curves
+        :param points: buckets kept, the resolution of the curves
+        :param window: number of recent episodes the rolling mean score is over
+        """
+        self.capacity, self.window = points - points % 2, window
+        self.reset()
+
+    def reset(self):
+        """Start the curves over."""
+        self.size, self.count = 1, 0  # episodes per bucket, episodes added
+        self.recent = np.zeros(0, dtype=np.float64)  # scores of the last window episodes
+        self.max_score = 0
+        self.alpha, self.states, self.episode = float('nan'), 0, 0
+        self.frames_per_second = float('nan')  # over the records of the last add
+        self.last_time = None
+        # per bucket, summed or the min/max of its episodes, and the value of its last episode
+        self.sums = {name: np.zeros(self.capacity) for name in ('score', 'frames', 'episodes')}
+        self.mins, self.maxs = np.full(self.capacity, np.inf), np.full(self.capacity, -np.inf)
+        self.lasts = {name: np.full(self.capacity, np.nan) for name in ('alpha', 'states', 'time')}
+
+    def add(self, records):
+        """
+        Add new records of the training log.
+        :param records: TRAINING_LOG_DTYPE records following the ones already added
+        """
+        k = len(records)
+        if not k:
+            return
+        while (self.count + k + self.size - 1) // self.size > self.capacity:
+            self.merge()
+        ids = (self.count + np.arange(k)) // self.size
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], k] - 1
+        buckets = slice(ids[0], ids[-1] + 1)
+
+        scores = records['score'].astype(np.float64)
+        self.sums['score'][buckets] += np.add.reduceat(scores, starts)
+        self.sums['frames'][buckets] += np.add.reduceat(records['frames'].astype(np.float64), starts)
+        self.sums['episodes'][buckets] += np.diff(np.r_[starts, k])
+        self.mins[buckets] = np.minimum(self.mins[buckets], np.minimum.reduceat(scores, starts))
+        self.maxs[buckets] = np.maximum(self.maxs[buckets], np.maximum.reduceat(scores, starts))
+        for name in self.lasts:
+            self.lasts[name][buckets] = records[name][ends]
+
+        frames = float(records['frames'].sum())
+        if self.last_time is not None and records['time'][-1] > self.last_time:
+            self.frames_per_second = frames / (records['time'][-1] - self.last_time)
+        self.last_time = float(records['time'][-1])
+        self.recent = np.r_[self.recent, scores][-self.window:]
+        self.max_score = max(self.max_score, int(records['score'].max()))
+        self.alpha, self.states = float(records['alpha'][-1]), int(records['states'][-1])
+        self.episode = max(self.episode, int(records['episode'].max()))  # the episodes of a batch end out of order
+        self.count += k
+
+    def merge(self):
+        """Merge neighbouring buckets, doubling the bucket size and freeing half the buckets."""
+        half = self.capacity // 2
+        for sums in self.sums.values():
+            sums[:half] = sums[0::2] + sums[1::2]
+            sums[half:] = 0
+        self.mins[:half] = np.minimum(self.mins[0::2], self.mins[1::2])
+        self.maxs[:half] = np.maximum(self.maxs[0::2], self.maxs[1::2])
+        self.mins[half:], self.maxs[half:] = np.inf, -np.inf
+        for lasts in self.lasts.values():
+            # the second bucket of the last pair is empty if the episodes fill an odd number of buckets
+            lasts[:half] = np.where(np.isnan(lasts[1::2]), lasts[0::2], lasts[1::2])
+            lasts[half:] = np.nan
+        self.size *= 2
+
+    def rolling_mean(self):
+        """Mean score of the last window episodes."""
+        return float(self.recent.mean()) if len(self.recent) else float('nan')
+
+    def curves(self):
+        """
+        The curves at the resolution of the buckets.
+        :return: dict of arrays, one value per filled bucket: episode (episodes ended up to the end of the bucket),
+        mean_score, min_score, max_score (so far), alpha, states and frames_per_second
+        """
+        n = (self.count + self.size - 1) // self.size
+        times = self.lasts['time'][:n]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frames_per_second = self.sums['frames'][1:n] / np.diff(times)
+        frames_per_second[~np.isfinite(frames_per_second)] = np.nan
+        return {'episode': np.cumsum(self.sums['episodes'][:n]),
+                'mean_score': self.sums['score'][:n] / self.sums['episodes'][:n],
+                'min_score': self.mins[:n], 'max_score': np.maximum.accumulate(self.maxs[:n]),
+                'alpha': self.lasts['alpha'][:n], 'states': self.lasts['states'][:n],
+                'frames_per_second': np.r_[np.nan, frames_per_second][:n]}
+
+    def summary(self):
+        """One line of the latest values."""
+        return (f"Episode: {self.episode}, rolling_mean: {self.rolling_mean():.1f}, max_score: {self.max_score}, "
+                f"alpha: {self.alpha:.3f}, states: {self.states}, {self.frames_per_second:,.0f} frames/s")
+
+
+def plot(stats, tail, interval):
+    """
+    Draw the curves in a window, redrawn every interval until the window is closed.
+    :param stats: LiveStats
+    :param tail: LogTail of the training log
+    :param interval: seconds between reading the log
+    """
+    import matplotlib.pyplot as plt
+    plt.ion()
+    fig, axes = plt.subplots(2, 2, sharex=True, figsize=(12, 7))
+    (ax_score, ax_alpha), (ax_states, ax_speed) = axes
+    ax_score.set_yscale('symlog')
+    lines = {name: ax.plot([], [], label=name, color=color, alpha=alpha)[0]
+             for name, ax, color, alpha in (('min_score', ax_score, 'b', 0.3), ('max_score', ax_score, 'g', 1),
+                                            ('mean_score', ax_score, 'orange', 1), ('alpha', ax_alpha, 'r', 1),
+                                            ('states', ax_states, 'purple', 1),
+                                            ('frames_per_second', ax_speed, 'k', 1))}
+    for ax, label in ((ax_score, 'Score'), (ax_alpha, 'Alpha'), (ax_states, 'Q-table states'),
+                      (ax_speed, 'Frames/s')):
+        ax.set_ylabel(label)
+    for ax in axes[1]:
+        ax.set_xlabel('Episode')
+    ax_score.legend(loc='upper left')
+    fig.tight_layout()
+    while plt.fignum_exists(fig.number):
+        if update(stats, tail):
+            curves = stats.curves()
+            for name, line in lines.items():
+                line.set_data(curves['episode'], curves[name])
+            for ax in axes.flat:
+                ax.relim()
+                ax.autoscale_view()
+            fig.suptitle(stats.summary())
+        plt.pause(interval)
+
+
+def update(stats, tail, limit=2 ** 20):
+    """
+    Add the new records of the log to the stats, starting over if the log was started over.
+    :param stats: LiveStats
+    :param tail: LogTail of the training log
+    :return: True if there were new records
+    """
+    changed = False
+    while True:
+        records, restarted = tail.read(limit)
+        if restarted:
+            stats.reset()
+        stats.add(records)
+        changed |= len(records) > 0 or restarted
+        if len(records) < limit:
+            return changed
+
+
+def main(path="data/training_log.bin", interval=1.0, window=1000, show_plot=True):
+    """
+    Follow a training log until ctrl+c or the window is closed, in a process of its own rather than the training loop.
+    :param path: training log
+    :param interval: seconds between reading the log
+    :param window: number of recent episodes the rolling mean score is over
+    :param show_plot: draw the curves with matplotlib, else only print a line when there are new episodes
+    """
+    stats, tail = LiveStats(window=window), LogTail(path)
+    print(f"Following {path}, ctrl+c to stop...")
+    try:
+        if show_plot:
+            plot(stats, tail, interval)
+        else:
+            while True:
+                if update(stats, tail):
+                    print(stats.summary())
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tail.close()
+
+
+if __name__ == '__main__':
+    # Follow the given training log (default data/training_log.bin)
+    main(*sys.argv[1:2])
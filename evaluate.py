@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from collision_table import CollisionTable
+from config import config
+from flappy_env import FlappyEnv, HITMASK_PATH, episode_rng, preload_hitmasks
+from q_learning import QLearning
+from storage import save_training_values
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DEADLINE_FRAMES = 10000  # frames between checks of the wall-clock budget
+
+_AGENT, _COLLISION_TABLE = None, None  # loaded once per worker process
+
+
+def init_worker():
+    """Load the Q-table once for every episode this worker plays, it is never trained or saved."""
+    global _AGENT, _COLLISION_TABLE
+    _AGENT = QLearning(False)
+    preload_hitmasks(HITMASK_PATH if config['hitmask_cache'] else None)
+    _COLLISION_TABLE = CollisionTable() if config['collision_table'] else None
+
+
+def play_episode(args):
+    """
+    Play one episode without training.
+    :param args: (episode, seed, max_score, deadline) where seed is the run seed, max_score ends the episode when
+    reached and deadline is a time.time() to stop at, None for no limits
+    :return: (episode, score, how the episode ended: 'crashed', 'max_score' or 'timeout'), score is None if the
+    deadline passed before the episode started
+    """
+    episode, seed, max_score, deadline = args
+    if deadline is not None and time.time() >= deadline:
+        return episode, None, 'timeout'
+
+    env = FlappyEnv(episode_rng(seed, episode), _COLLISION_TABLE)
+    env.reset()
+    frame = 0
+    while True:
+        action = _AGENT.act(env.player_x, env.player_y, env.player_vel_y, env.lower_pipes)
+        crash_test, scored = env.step(action)
+        if crash_test[0]:
+            return episode, env.score, 'crashed'
+        if scored and max_score and env.score >= max_score:
+            return episode, env.score, 'max_score'
+        frame += 1
+        if deadline is not None and frame % DEADLINE_FRAMES == 0 and time.time() >= deadline:
+            return episode, env.score, 'timeout'
+
+
+def summarise(scores, ends):
+    """
+    Score distribution of an evaluation.
+    :param scores: score of every episode
+    :param ends: how every episode ended, see play_episode
+    :return: dict of statistics
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    deaths = sum(end == 'crashed' for end in ends)
+    # a bird that dies at score s reached s + 1 pipes, the others are cut short so only count the pipes passed
+    pipes = scores.sum() + deaths
+    summary = {'episodes': len(scores), 'deaths': deaths, 'death_rate': deaths / pipes if pipes else 0.0}
+    if len(scores):
+        summary.update(mean=scores.mean(), std=scores.std(), max=scores.max(),
+                       cv=scores.std() / scores.mean() if scores.mean() else 0.0,
+                       **{f"q{int(q * 100)}": value for q, value in zip(QUANTILES, np.quantile(scores, QUANTILES))})
+        summary['median'] = summary['q50']
+    return summary
+
+
+def evaluate(episodes=25, workers=None, seed=None, budget=None, max_score=None, output=None):
+    """
+    Evaluate the agent in data/q_values_resume.qtable over a process pool, printing the episodes as they finish.
+    :param episodes: number of episodes to play
+    :param workers: number of worker processes, default the number of CPUs
+    :param seed: run seed the sprites and pipes of every episode are derived from, None for a random seed
+    :param budget: stop after this many seconds, episodes still running are counted up to their current score
+    :param max_score: end an episode when reaching this score, default config['max_score']
+    :param output: save the scores to this json file in the training_values format for analysis.py
+    :return: summarise() of the scores
+    """
+    workers = min(workers or os.cpu_count(), episodes)
+    max_score = config['max_score'] if max_score is None else max_score
+    if config['collision_table']:
+        CollisionTable()  # compute and save the table once rather than in every worker
+    preload_hitmasks(HITMASK_PATH if config['hitmask_cache'] else None)
+    QLearning.read_qvalues()  # import a json Q-table once rather than in every worker
+    seed = np.random.SeedSequence().entropy if seed is None else seed
+    print(f"Evaluating agent over {episodes} episodes with {workers} workers, seed {seed}...")
+    deadline = time.time() + budget if budget else None
+    tasks = [(episode, seed, max_score, deadline) for episode in range(1, episodes + 1)]
+
+    scores, ends = [], []
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+        try:
+            for episode, score, end in pool.imap_unordered(play_episode, tasks):
+                if score is None:
+                    continue
+                scores.append(score)
+                ends.append(end)
+                print(f"Episode: {episode}, score: {score}, {end}, max_score: {max(scores)}, "
+                      f"{time.perf_counter() - start:.0f}s")
+        except KeyboardInterrupt:
+            print('')
+            pool.terminate()
+
+    summary = summarise(scores, ends)
+    print(", ".join(f"{name}: {value:,.6g}" for name, value in summary.items()))
+    if output:
+        save_training_values(output, len(scores), scores, seed)
+    return summary
+
+
+if __name__ == '__main__':
+    # Evaluate for the given number of episodes (default 25) with the given number of workers and seconds of budget
+    evaluate(*(int(arg) for arg in sys.argv[1:3]), budget=float(sys.argv[3]) if len(sys.argv) > 3 else None)
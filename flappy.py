@@ -92,39 +92,36 @@ def main():
     SOUNDS['swoosh'] = pygame.mixer.Sound('assets/audio/swoosh' + soundExt)
     SOUNDS['wing'] = pygame.mixer.Sound('assets/audio/wing' + soundExt)
 
+    # every background, player and pipe sprite and its hitmask is loaded once, an episode only picks from them
+    IMAGES['backgrounds'] = tuple(pygame.image.load(path).convert() for path in BACKGROUNDS_LIST)
+    IMAGES['players'] = tuple(
+        tuple(pygame.image.load(path).convert_alpha() for path in player) for player in PLAYERS_LIST
+    )
+    IMAGES['pipes'] = tuple(
+        (pygame.transform.flip(pipe, False, True), pipe)
+        for pipe in (pygame.image.load(path).convert_alpha() for path in PIPES_LIST)
+    )
+    HITMASKS['players'] = tuple(tuple(getHitmask(image) for image in player) for player in IMAGES['players'])
+    HITMASKS['pipes'] = tuple(tuple(getHitmask(image) for image in pipe) for pipe in IMAGES['pipes'])
+
     while True:
         # select random background sprites
         randBg = random.randint(0, len(BACKGROUNDS_LIST) - 1)
-        IMAGES['background'] = pygame.image.load(BACKGROUNDS_LIST[randBg]).convert()
+        IMAGES['background'] = IMAGES['backgrounds'][randBg]
 
         # select random player sprites
         randPlayer = random.randint(0, len(PLAYERS_LIST) - 1)
-        IMAGES['player'] = (
-            pygame.image.load(PLAYERS_LIST[randPlayer][0]).convert_alpha(),
-            pygame.image.load(PLAYERS_LIST[randPlayer][1]).convert_alpha(),
-            pygame.image.load(PLAYERS_LIST[randPlayer][2]).convert_alpha(),
-        )
+        IMAGES['player'] = IMAGES['players'][randPlayer]
 
         # select random pipe sprites
         pipeindex = random.randint(0, len(PIPES_LIST) - 1)
-        IMAGES['pipe'] = (
-            pygame.transform.flip(
-                pygame.image.load(PIPES_LIST[pipeindex]).convert_alpha(), False, True),
-            pygame.image.load(PIPES_LIST[pipeindex]).convert_alpha(),
-        )
+        IMAGES['pipe'] = IMAGES['pipes'][pipeindex]
 
         # hismask for pipes
-        HITMASKS['pipe'] = (
-            getHitmask(IMAGES['pipe'][0]),
-            getHitmask(IMAGES['pipe'][1]),
-        )
+        HITMASKS['pipe'] = HITMASKS['pipes'][pipeindex]
 
         # hitmask for player
-        HITMASKS['player'] = (
-            getHitmask(IMAGES['player'][0]),
-            getHitmask(IMAGES['player'][1]),
-            getHitmask(IMAGES['player'][2]),
-        )
+        HITMASKS['player'] = HITMASKS['players'][randPlayer]
 
         movementInfo = showWelcomeAnimation()
         crashInfo = mainGame(movementInfo)
@@ -0,0 +1,735 @@
+import hashlib
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# Headless FlapPyBird simulation, no pygame or display required
+
+SCREENWIDTH = 288
+SCREENHEIGHT = 512
+PIPEGAPSIZE = 100  # gap between upper and lower part of pipe
+BASEY = SCREENHEIGHT * 0.79
+
+# sprite sizes, precomputed so the simulation never touches a pygame Surface
+PLAYER_WIDTH, PLAYER_HEIGHT = 34, 24
+PIPE_WIDTH, PIPE_HEIGHT = 52, 320
+BASE_WIDTH = 336
+BACKGROUND_WIDTH = 288
+BASE_SHIFT = BASE_WIDTH - BACKGROUND_WIDTH  # amount by which base can maximum shift to left
+
+# list of all possible players (tuple of 3 positions of flap)
+PLAYERS_LIST = (
+    # red bird
+    (
+        'assets/sprites/redbird-upflap.png',
+        'assets/sprites/redbird-midflap.png',
+        'assets/sprites/redbird-downflap.png',
+    ),
+    # blue bird
+    (
+        'assets/sprites/bluebird-upflap.png',
+        'assets/sprites/bluebird-midflap.png',
+        'assets/sprites/bluebird-downflap.png',
+    ),
+    # yellow bird
+    (
+        'assets/sprites/yellowbird-upflap.png',
+        'assets/sprites/yellowbird-midflap.png',
+        'assets/sprites/yellowbird-downflap.png',
+    ),
+)
+
+# list of backgrounds
+BACKGROUNDS_LIST = (
+    'assets/sprites/background-day.png',
+    'assets/sprites/background-night.png',
+)
+
+# list of pipes
+PIPES_LIST = (
+    'assets/sprites/pipe-green.png',
+    'assets/sprites/pipe-red.png',
+)
+
+PLAYER_X = int(SCREENWIDTH * 0.2)  # the bird never moves along x
+PLAYER_INDEX_CYCLE = (0, 1, 2, 1)  # playerIndexGen of the original game
+PIPE_SLOTS = 3  # at most 3 pipes are on screen, a pipe spawns when the first is about to leave the screen
+PIPE_VEL_X = -4
+PLAYER_MAX_VEL_Y = 10  # max vel along Y, max descend speed
+PLAYER_ACC_Y = 1  # players downward accleration
+PLAYER_FLAP_ACC = -9  # players speed on flapping
+
+# one frame of SnapshotHistory, pipes are padded to PIPE_SLOTS
+SNAPSHOT_DTYPE = np.dtype([('player_x', np.int64), ('player_y', np.float64), ('player_vel_y', np.int64),
+                           ('score', np.int64), ('player_index', np.int64), ('n_pipes', np.int64),
+                           ('pipe_x', np.float64, PIPE_SLOTS), ('upper_y', np.int64, PIPE_SLOTS),
+                           ('lower_y', np.int64, PIPE_SLOTS)])
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # colour type: samples per pixel
+
+_HITMASKS, _BITMASKS = {}, {}  # sprite path (and rotation) -> hitmask/bitmask, loaded once per process
+HITMASK_PATH = "data/hitmasks.npz"
+
+
+def episode_rng(seed, *episode):
+    """
+    Random number generator for the sprites and pipes of one episode, the same for the same run seed and episode.
+    :param seed: run seed
+    :param episode: episode number, followed by any numbers telling apart several plays of the same episode
+    :return: numpy random Generator
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=episode))
+
+
+def read_alpha(path):
+    """
+    Read the alpha channel of a non-interlaced PNG without pygame.
+    :param path: path to the png
+    :return: rows of alpha values (0-255)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError(f"{path} is not a png file")
+
+    pos, idat, trns = 8, b'', None
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        if chunk_type == b'IHDR':
+            width, height, depth, colour, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'tRNS':
+            trns = chunk
+        elif chunk_type == b'IDAT':
+            idat += chunk
+        pos += 12 + length
+    if interlace:
+        raise ValueError(f"{path} is interlaced, which is not supported")
+
+    channels = PNG_CHANNELS[colour]
+    stride = (width * channels * depth + 7) // 8
+    bpp = max(1, channels * depth // 8)  # bytes per complete pixel, used by the filters
+    raw = zlib.decompress(idat)
+
+    alpha, prev, i = [], bytearray(stride), 0
+    for _ in range(height):
+        filter_type, line = raw[i], bytearray(raw[i + 1:i + 1 + stride])
+        i += 1 + stride
+        for j in range(stride):
+            a = line[j - bpp] if j >= bpp else 0
+            b = prev[j]
+            if filter_type == 1:
+                line[j] = (line[j] + a) & 0xff
+            elif filter_type == 2:
+                line[j] = (line[j] + b) & 0xff
+            elif filter_type == 3:
+                line[j] = (line[j] + (a + b) // 2) & 0xff
+            elif filter_type == 4:
+                c = prev[j - bpp] if j >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                line[j] = (line[j] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xff
+        prev = line
+
+        if colour == 6:
+            alpha.append([line[x * 4 * depth // 8 + 3 * depth // 8] for x in range(width)])
+        elif colour == 4:
+            alpha.append([line[x * 2 * depth // 8 + depth // 8] for x in range(width)])
+        elif colour == 3:
+            mask = (1 << depth) - 1
+            row = []
+            for x in range(width):
+                bit = x * depth
+                index = (line[bit // 8] >> (8 - depth - bit % 8)) & mask
+                row.append(trns[index] if trns and index < len(trns) else 255)
+            alpha.append(row)
+        else:
+            alpha.append([255] * width)  # greyscale/rgb without alpha, colour keys are not used by the sprites
+    return alpha
+
+
+def load_hitmask(path, rotate=False):
+    """
+    Returns a hitmask using an image's alpha, indexed as hitmask[x][y] like getHitmask.
+    :param path: path to the sprite
+    :param rotate: rotate the sprite by 180 degrees (upper pipes)
+    :return: hitmask
+    """
+    key = (path, rotate)
+    if key not in _HITMASKS:
+        alpha = read_alpha(path)
+        mask = [[bool(row[x]) for row in alpha] for x in range(len(alpha[0]))]
+        if rotate:
+            mask = [list(reversed(column)) for column in reversed(mask)]
+        _HITMASKS[key] = mask
+    return _HITMASKS[key]
+
+
+def load_bitmask(path, rotate=False):
+    """
+    Returns a hitmask packed into one integer per row, bit x of row y is set if pixel (x, y) is opaque.
+    :param path: path to the sprite
+    :param rotate: rotate the sprite by 180 degrees (upper pipes)
+    :return: tuple of rows
+    """
+    key = (path, rotate)
+    if key not in _BITMASKS:
+        hitmask = load_hitmask(path, rotate)
+        _BITMASKS[key] = tuple(sum(1 << x for x, column in enumerate(hitmask) if column[y])
+                               for y in range(len(hitmask[0])))
+    return _BITMASKS[key]
+
+
+def preload_hitmasks(path=HITMASK_PATH):
+    """
+    Load the hitmask and bitmask of every player and pipe sprite once, so no environment or episode decodes a png.
+    :param path: npz file the hitmasks are read from and saved to when a sprite is new or changed, None to always
+    decode the pngs
+    """
+    sprites = [(sprite, False) for player in PLAYERS_LIST for sprite in player] + \
+              [(sprite, rotate) for sprite in PIPES_LIST for rotate in (True, False)]
+    cache = {}
+    if path:
+        try:
+            with np.load(path) as saved:
+                cache = {key: (saved[f"mask_{i}"], saved[f"bits_{i}"])
+                         for i, key in enumerate(saved['keys'].tolist())}
+        except (IOError, KeyError, ValueError):
+            pass
+
+    # saved hitmasks are keyed by a hash of the sprite so that editing a png invalidates its hitmask
+    keys, changed = [], False
+    for sprite, rotate in sprites:
+        with open(sprite, 'rb') as f:
+            key = f"{hashlib.sha1(f.read()).hexdigest()}_{int(rotate)}"
+        keys.append(key)
+        if (sprite, rotate) not in _HITMASKS:
+            if key in cache:
+                _HITMASKS[(sprite, rotate)] = cache[key][0].tolist()
+                _BITMASKS[(sprite, rotate)] = tuple(cache[key][1].tolist())
+            else:
+                changed = True
+        load_bitmask(sprite, rotate)
+
+    if path and changed:
+        tmp_path = f"{path}.tmp.npz"
+        # sprites are narrower than 64 pixels, so each bitmask row fits a uint64
+        np.savez_compressed(tmp_path, keys=np.array(keys),
+                            **{f"mask_{i}": np.array(_HITMASKS[sprite], dtype=bool) for i, sprite in enumerate(sprites)},
+                            **{f"bits_{i}": np.array(_BITMASKS[sprite], dtype=np.uint64)
+                               for i, sprite in enumerate(sprites)})
+        os.replace(tmp_path, path)
+
+
+def bitmask_collision(rect1, rect2, bitmask1, bitmask2):
+    """
+    Checks if two objects collide and not just their rects, same result as pixel_collision.
+    :param rect1: (x, y, w, h) of the first object
+    :param rect2: (x, y, w, h) of the second object
+    :param bitmask1: bitmask of the first object
+    :param bitmask2: bitmask of the second object
+    :return: True if any opaque pixels overlap
+    """
+    # pygame.Rect truncates coordinates to integers
+    x1, y1, x2, y2 = int(rect1[0]), int(rect1[1]), int(rect2[0]), int(rect2[1])
+    if x1 >= x2 + rect2[2] or x2 >= x1 + rect1[2]:
+        return False
+    top, bottom = max(y1, y2), min(y1 + rect1[3], y2 + rect2[3])
+    if bottom <= top:
+        return False
+
+    # shift one row onto the other, bits outside the other object's width are 0 so the AND also clips in x
+    rows1, rows2 = bitmask1[top - y1:bottom - y1], bitmask2[top - y2:bottom - y2]
+    shift = x1 - x2
+    if shift >= 0:
+        return any(row1 << shift & row2 for row1, row2 in zip(rows1, rows2))
+    return any(row1 & row2 << -shift for row1, row2 in zip(rows1, rows2))
+
+
+def pixel_collision(rect1, rect2, hitmask1, hitmask2):
+    """
+    Checks if two objects collide and not just their rects, pixel by pixel. Reference for bitmask_collision.
+    :param rect1: (x, y, w, h) of the first object
+    :param rect2: (x, y, w, h) of the second object
+    :param hitmask1: hitmask of the first object
+    :param hitmask2: hitmask of the second object
+    :return: True if any opaque pixels overlap
+    """
+    # pygame.Rect truncates coordinates to integers
+    x1, y1, w1, h1 = int(rect1[0]), int(rect1[1]), rect1[2], rect1[3]
+    x2, y2, w2, h2 = int(rect2[0]), int(rect2[1]), rect2[2], rect2[3]
+    left, right = max(x1, x2), min(x1 + w1, x2 + w2)
+    top, bottom = max(y1, y2), min(y1 + h1, y2 + h2)
+    if right <= left or bottom <= top:
+        return False
+
+    for x in range(left, right):
+        column1, column2 = hitmask1[x - x1], hitmask2[x - x2]
+        for y in range(top, bottom):
+            if column1[y - y1] and column2[y - y2]:
+                return True
+    return False
+
+
+class FlappyEnv:
+    """
+    The FlapPyBird game physics (gravity, flap, pipe scrolling, pipe spawning, scoring and collisions) without pygame.
+
+    mainGame in flappy_rl.py renders on top of this environment, training without the display only needs this class.
+    Call reset() to start each episode, with an episode_rng() to make the episode reproducible.
+    """
+    def __init__(self, rng=None, collision_table=None):
+        """
+        Initialise the environment
+        :param rng: numpy random Generator for the sprites and pipes
+        :param collision_table: CollisionTable to look up pipe collisions instead of testing the bitmasks
+        """
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.collision_table = collision_table
+        self.profiler = None  # profiling.Profiler to time the phases of step
+        self.player_bitmasks = tuple(tuple(load_bitmask(path) for path in player) for player in PLAYERS_LIST)
+        self.pipe_bitmasks = tuple((load_bitmask(path, rotate=True), load_bitmask(path)) for path in PIPES_LIST)
+
+    def reset(self, player=None, pipe=None, playery=None, rng=None, background=None):
+        """
+        Start a new episode.
+        :param player: index into PLAYERS_LIST, random if not given
+        :param pipe: index into PIPES_LIST, random if not given
+        :param playery: initial bird y, default is the middle of the screen
+        :param rng: numpy random Generator for this episode, default is to carry on with the current one
+        :param background: index into BACKGROUNDS_LIST, only drawn by the display, random if not given
+        """
+        if rng is not None:
+            self.rng = rng
+        self.player = int(self.rng.integers(0, len(PLAYERS_LIST))) if player is None else player
+        self.pipe = int(self.rng.integers(0, len(PIPES_LIST))) if pipe is None else pipe
+        self.background = int(self.rng.integers(0, len(BACKGROUNDS_LIST))) if background is None else background
+
+        self.score = self.player_index = self.loop_iter = self.cycle_index = 0
+        self.player_x = PLAYER_X
+        self.player_y = int((SCREENHEIGHT - PLAYER_HEIGHT) / 2) if playery is None else playery
+        self.player_vel_y = -9  # player's velocity along Y, default same as playerFlapped
+        self.player_flapped = False  # True when player flaps
+        self.basex = 0
+
+        # get 2 new pipes to add to upper_pipes lower_pipes list
+        new_pipe1 = self.get_random_pipe()
+        new_pipe2 = self.get_random_pipe()
+        self.upper_pipes = [
+            {'x': SCREENWIDTH + 200, 'y': new_pipe1[0]['y']},
+            {'x': SCREENWIDTH + 200 + (SCREENWIDTH / 2), 'y': new_pipe2[0]['y']},
+        ]
+        self.lower_pipes = [
+            {'x': SCREENWIDTH + 200, 'y': new_pipe1[1]['y']},
+            {'x': SCREENWIDTH + 200 + (SCREENWIDTH / 2), 'y': new_pipe2[1]['y']},
+        ]
+
+    def get_random_pipe(self):
+        """Returns a randomly generated pipe"""
+        # y of gap between upper and lower pipe
+        gap_y = int(self.rng.integers(0, int(BASEY * 0.6 - PIPEGAPSIZE)))
+        gap_y += int(BASEY * 0.2)
+        pipe_x = SCREENWIDTH + 10
+
+        return [
+            {'x': pipe_x, 'y': gap_y - PIPE_HEIGHT},  # upper pipe
+            {'x': pipe_x, 'y': gap_y + PIPEGAPSIZE},  # lower pipe
+        ]
+
+    def flap(self):
+        """Flap if the bird is not too far above the screen."""
+        if self.player_y > -2 * PLAYER_HEIGHT:
+            self.player_vel_y = PLAYER_FLAP_ACC
+            self.player_flapped = True
+
+    def check_crash(self):
+        """
+        Check if the bird collides with the base or pipes.
+        :return: [crashed, crashed into the ground]
+        """
+        # if player crashes into ground
+        if self.player_y + PLAYER_HEIGHT >= BASEY - 1:
+            return [True, True]
+
+        # pipes are further apart than the bird is wide, so only the nearest pipe pair not yet passed can be hit
+        player_left = int(self.player_x)
+        for u_pipe, l_pipe in zip(self.upper_pipes, self.lower_pipes):
+            if int(u_pipe['x']) + PIPE_WIDTH > player_left:
+                break
+        else:
+            return [False, False]
+        if int(u_pipe['x']) >= player_left + PLAYER_WIDTH:
+            return [False, False]
+
+        if self.collision_table is not None:
+            return [self.collision_table.crash(self.player, self.player_index, self.pipe, self.player_x, self.player_y,
+                                               u_pipe['x'], u_pipe['y'], l_pipe['y']), False]
+
+        # if bird collided with upipe or lpipe
+        player_rect = (self.player_x, self.player_y, PLAYER_WIDTH, PLAYER_HEIGHT)
+        player_bitmask = self.player_bitmasks[self.player][self.player_index]
+        upper_bitmask, lower_bitmask = self.pipe_bitmasks[self.pipe]
+        if bitmask_collision(player_rect, (u_pipe['x'], u_pipe['y'], PIPE_WIDTH, PIPE_HEIGHT),
+                             player_bitmask, upper_bitmask) or \
+                bitmask_collision(player_rect, (l_pipe['x'], l_pipe['y'], PIPE_WIDTH, PIPE_HEIGHT),
+                                  player_bitmask, lower_bitmask):
+            return [True, False]
+
+        return [False, False]
+
+    def step(self, action, move_pipes=True):
+        """
+        Advance the game by one frame.
+        :param action: 0 is do nothing, 1 is flap
+        :param move_pipes: scroll the pipes, they are held still while resuming from a saved state
+        :return: ([crashed, crashed into the ground], scored this frame), the frame is not advanced on a crash
+        """
+        if action:
+            self.flap()
+
+        profiler = self.profiler
+        crash_test = self.check_crash()
+        if profiler is not None:
+            profiler.lap('crash')
+        if crash_test[0]:
+            return crash_test, False
+
+        # check for score
+        scored = False
+        player_mid_pos = self.player_x + PLAYER_WIDTH / 2
+        for pipe in self.upper_pipes:
+            pipe_mid_pos = pipe['x'] + PIPE_WIDTH / 2
+            if pipe_mid_pos <= player_mid_pos < pipe_mid_pos + 4:
+                self.score += 1
+                scored = True
+        if profiler is not None:
+            profiler.lap('score')
+
+        # player_index basex change
+        if (self.loop_iter + 1) % 3 == 0:
+            self.cycle_index = (self.cycle_index + 1) % len(PLAYER_INDEX_CYCLE)
+            self.player_index = PLAYER_INDEX_CYCLE[self.cycle_index - 1]
+        self.loop_iter = (self.loop_iter + 1) % 30
+        self.basex = -((-self.basex + 100) % BASE_SHIFT)
+
+        # player's movement
+        if self.player_vel_y < PLAYER_MAX_VEL_Y and not self.player_flapped:
+            self.player_vel_y += PLAYER_ACC_Y
+        self.player_flapped = False
+        self.player_y += min(self.player_vel_y, BASEY - self.player_y - PLAYER_HEIGHT)
+        if profiler is not None:
+            profiler.lap('physics')
+
+        # move pipes to left
+        if move_pipes:
+            for u_pipe, l_pipe in zip(self.upper_pipes, self.lower_pipes):
+                u_pipe['x'] += PIPE_VEL_X
+                l_pipe['x'] += PIPE_VEL_X
+
+        # add new pipe when first pipe is about to touch left of screen
+        if 0 < self.upper_pipes[0]['x'] < 5:
+            new_pipe = self.get_random_pipe()
+            self.upper_pipes.append(new_pipe[0])
+            self.lower_pipes.append(new_pipe[1])
+
+        # remove first pipe if its out of the screen
+        if self.upper_pipes[0]['x'] < -PIPE_WIDTH:
+            self.upper_pipes.pop(0)
+            self.lower_pipes.pop(0)
+        if profiler is not None:
+            profiler.lap('pipes')
+
+        return crash_test, scored
+
+
+class SnapshotHistory:
+    """
+    The last few frames of a FlappyEnv, to resume from, in a preallocated ring of SNAPSHOT_DTYPE records.
+
+    Each frame is written in place over the oldest, nothing is allocated or deep copied per frame. Frames are indexed
+    from the oldest like a deque.
+    """
+    def __init__(self, maxlen=70):
+        """
+        Initialise an empty history
+        :param maxlen: number of frames kept
+        """
+        self.records = np.zeros(maxlen, dtype=SNAPSHOT_DTYPE)
+        self.maxlen = maxlen
+        self.start = self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        """Forget every frame."""
+        self.start = self.length = 0
+
+    def slot(self, i):
+        """Ring slot of the i-th oldest frame, negative from the newest."""
+        if not -self.length <= i < self.length:
+            raise IndexError("Snapshot history index out of range")
+        return (self.start + i % self.length) % self.maxlen
+
+    def record(self, env):
+        """
+        Save the state needed to resume from this frame, replacing the oldest frame if full.
+        :param env: FlappyEnv
+        """
+        if self.length < self.maxlen:
+            slot = (self.start + self.length) % self.maxlen
+            self.length += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.maxlen
+        padding = (0,) * (PIPE_SLOTS - len(env.lower_pipes))
+        self.records[slot] = (env.player_x, env.player_y, env.player_vel_y, env.score, env.player_index,
+                              len(env.lower_pipes), tuple(pipe['x'] for pipe in env.lower_pipes) + padding,
+                              tuple(pipe['y'] for pipe in env.upper_pipes) + padding,
+                              tuple(pipe['y'] for pipe in env.lower_pipes) + padding)
+
+    def score(self, i):
+        """Score at the i-th oldest frame, negative from the newest."""
+        return int(self.records['score'][self.slot(i)])
+
+    def restore(self, env, i, pipes_only=False):
+        """
+        Resume from a saved frame.
+        :param env: FlappyEnv
+        :param i: index of the frame from the oldest, negative from the newest
+        :param pipes_only: only restore the pipes, the bird keeps flying
+        """
+        record = self.records[self.slot(i)]
+        n_pipes = int(record['n_pipes'])
+        pipe_x = record['pipe_x'][:n_pipes].tolist()
+        env.upper_pipes = [{'x': x, 'y': y} for x, y in zip(pipe_x, record['upper_y'].tolist())]
+        env.lower_pipes = [{'x': x, 'y': y} for x, y in zip(pipe_x, record['lower_y'].tolist())]
+        if not pipes_only:
+            env.player_x, env.player_y, env.player_vel_y, env.score, env.player_index = \
+                (record[name].item() for name in ('player_x', 'player_y', 'player_vel_y', 'score', 'player_index'))
+
+
+class BatchFlappyEnv:
+    """
+    N birds playing independent FlapPyBird games, stepped together with NumPy.
+
+    Each bird follows the same physics as FlappyEnv. Pipes are held in (N, PIPE_SLOTS) arrays ordered left to right,
+    empty slots have an x of inf. Birds that crash are not advanced, reset them with reset(mask) to start a new episode.
+    Every episode draws its sprites and pipes from its own episode_rng(seed, episode), so it plays out the same as in
+    FlappyEnv with that generator.
+    """
+    def __init__(self, n, seed=None, collision_table=None, episode=0):
+        """
+        Initialise the environment
+        :param n: number of birds
+        :param seed: run seed for the sprites and pipes of every episode, None for a random seed
+        :param collision_table: CollisionTable to look up pipe collisions for all birds at once
+        :param episode: episodes started are numbered from episode + 1
+        """
+        self.n = n
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.episode = episode
+        self.collision_table = collision_table
+        self.player_bitmasks = tuple(tuple(load_bitmask(path) for path in player) for player in PLAYERS_LIST)
+        self.pipe_bitmasks = tuple((load_bitmask(path, rotate=True), load_bitmask(path)) for path in PIPES_LIST)
+
+        self.player_x = PLAYER_X
+        self.player = np.zeros(n, dtype=np.int64)
+        self.pipe = np.zeros(n, dtype=np.int64)
+        self.background = np.zeros(n, dtype=np.int64)  # not drawn, kept so that the pipes match FlappyEnv
+        self.score = np.zeros(n, dtype=np.int64)
+        self.player_index = np.zeros(n, dtype=np.int64)
+        self.loop_iter = np.zeros(n, dtype=np.int64)
+        self.cycle_index = np.zeros(n, dtype=np.int64)
+        self.player_y = np.zeros(n, dtype=np.float64)
+        self.player_vel_y = np.zeros(n, dtype=np.int64)
+        self.pipe_x = np.full((n, PIPE_SLOTS), np.inf)
+        self.upper_y = np.zeros((n, PIPE_SLOTS), dtype=np.int64)
+        self.lower_y = np.zeros((n, PIPE_SLOTS), dtype=np.int64)
+        self.n_pipes = np.zeros(n, dtype=np.int64)
+        self.episodes = np.zeros(n, dtype=np.int64)  # episode number of each bird, numbered as the birds are reset
+        self.rngs = [None] * n  # random Generator of each bird's episode
+        self.reset()
+
+    def reset(self, mask=None):
+        """
+        Start new episodes.
+        :param mask: boolean mask or indices of the birds to reset, default is all birds
+        """
+        rows = np.arange(self.n) if mask is None else np.asarray(mask)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        k = len(rows)
+        if not k:
+            return
+
+        for i in rows.tolist():
+            self.episode += 1
+            self.episodes[i] = self.episode
+            self.rngs[i] = rng = episode_rng(self.seed, self.episode)
+            self.player[i] = rng.integers(0, len(PLAYERS_LIST))
+            self.pipe[i] = rng.integers(0, len(PIPES_LIST))
+            self.background[i] = rng.integers(0, len(BACKGROUNDS_LIST))
+        self.score[rows] = self.player_index[rows] = self.loop_iter[rows] = self.cycle_index[rows] = 0
+        self.player_y[rows] = int((SCREENHEIGHT - PLAYER_HEIGHT) / 2)
+        self.player_vel_y[rows] = -9  # player's velocity along Y, default same as playerFlapped
+
+        self.pipe_x[rows] = np.inf
+        self.pipe_x[rows, 0] = SCREENWIDTH + 200
+        self.pipe_x[rows, 1] = SCREENWIDTH + 200 + (SCREENWIDTH / 2)
+        for slot in range(2):
+            self.upper_y[rows, slot], self.lower_y[rows, slot] = self.get_random_pipes(rows)
+        self.n_pipes[rows] = 2
+
+    def get_random_pipes(self, rows):
+        """
+        Returns the y of a randomly generated pipe for each of the given birds
+        :param rows: indices of the birds
+        :return: upper pipe y, lower pipe y
+        """
+        # y of gap between upper and lower pipe
+        high = int(BASEY * 0.6 - PIPEGAPSIZE)
+        gap_y = np.array([self.rngs[i].integers(0, high) for i in rows.tolist()], dtype=np.int64) + int(BASEY * 0.2)
+        return gap_y - PIPE_HEIGHT, gap_y + PIPEGAPSIZE
+
+    def keep(self, rows):
+        """
+        Keep only some of the birds, e.g. to stop simulating birds whose episodes are finished.
+        :param rows: indices of the birds to keep, in their new order
+        """
+        rows = np.asarray(rows)
+        for name in ('player', 'pipe', 'score', 'player_index', 'loop_iter', 'cycle_index', 'player_y',
+                     'player_vel_y', 'pipe_x', 'upper_y', 'lower_y', 'n_pipes', 'episodes'):
+            setattr(self, name, getattr(self, name)[rows])
+        self.rngs = [self.rngs[i] for i in rows.tolist()]
+        self.n = len(rows)
+
+    def check_crash(self):
+        """
+        Check which birds collide with the base or pipes.
+        :return: (crashed, crashed into the ground) boolean arrays
+        """
+        ground = self.player_y + PLAYER_HEIGHT >= BASEY - 1
+        if self.collision_table is not None:
+            return ground | self.collision_table.crash_batch(self.player, self.player_index, self.pipe, PLAYER_X,
+                                                             self.player_y, self.pipe_x, self.upper_y,
+                                                             self.lower_y), ground
+
+        # rect overlap of every bird with every pipe, pygame.Rect truncates coordinates to integers
+        player_top = np.trunc(self.player_y)[:, None]
+        pipe_left = np.trunc(self.pipe_x)
+        level = (pipe_left < PLAYER_X + PLAYER_WIDTH) & (pipe_left + PIPE_WIDTH > PLAYER_X) & ~ground[:, None]
+        upper = level & (self.upper_y < player_top + PLAYER_HEIGHT) & (self.upper_y + PIPE_HEIGHT > player_top)
+        lower = level & (self.lower_y < player_top + PLAYER_HEIGHT) & (self.lower_y + PIPE_HEIGHT > player_top)
+
+        # only the few birds whose rects overlap a pipe need the bitmask test
+        crashed = ground.copy()
+        player_rect = [PLAYER_X, 0, PLAYER_WIDTH, PLAYER_HEIGHT]
+        for i in np.flatnonzero((upper | lower).any(axis=1)):
+            player_rect[1] = self.player_y[i]
+            player_bitmask = self.player_bitmasks[self.player[i]][self.player_index[i]]
+            upper_bitmask, lower_bitmask = self.pipe_bitmasks[self.pipe[i]]
+            for slot in np.flatnonzero(upper[i] | lower[i]):
+                x = self.pipe_x[i, slot]
+                upper_rect = (x, self.upper_y[i, slot], PIPE_WIDTH, PIPE_HEIGHT)
+                lower_rect = (x, self.lower_y[i, slot], PIPE_WIDTH, PIPE_HEIGHT)
+                if upper[i, slot] and bitmask_collision(player_rect, upper_rect, player_bitmask, upper_bitmask) or \
+                        lower[i, slot] and bitmask_collision(player_rect, lower_rect, player_bitmask, lower_bitmask):
+                    crashed[i] = True
+                    break
+        return crashed, ground
+
+    def step(self, actions):
+        """
+        Advance every bird by one frame.
+        :param actions: array of actions, 0 is do nothing, 1 is flap
+        :return: (crashed, crashed into the ground, scored this frame) boolean arrays, crashed birds are not advanced
+        """
+        flapped = np.asarray(actions, dtype=bool) & (self.player_y > -2 * PLAYER_HEIGHT)
+        self.player_vel_y[flapped] = PLAYER_FLAP_ACC
+
+        crashed, ground = self.check_crash()
+        alive = ~crashed
+
+        # check for score
+        player_mid_pos = PLAYER_X + PLAYER_WIDTH / 2
+        pipe_mid_pos = self.pipe_x + PIPE_WIDTH / 2
+        scores = ((pipe_mid_pos <= player_mid_pos) & (player_mid_pos < pipe_mid_pos + 4)).sum(axis=1) * alive
+        self.score += scores
+
+        # player_index change
+        advance = alive & ((self.loop_iter + 1) % 3 == 0)
+        self.cycle_index[advance] += 1
+        self.player_index[advance] = np.take(PLAYER_INDEX_CYCLE, self.cycle_index[advance] - 1, mode='wrap')
+        self.loop_iter[alive] = (self.loop_iter[alive] + 1) % 30
+
+        # player's movement
+        self.player_vel_y[alive & ~flapped & (self.player_vel_y < PLAYER_MAX_VEL_Y)] += PLAYER_ACC_Y
+        self.player_y[alive] += np.minimum(self.player_vel_y, BASEY - self.player_y - PLAYER_HEIGHT)[alive]
+
+        # move pipes to left
+        self.pipe_x[alive] += PIPE_VEL_X
+
+        # add new pipe when first pipe is about to touch left of screen
+        rows = np.flatnonzero(alive & (0 < self.pipe_x[:, 0]) & (self.pipe_x[:, 0] < 5))
+        if len(rows):
+            slots = self.n_pipes[rows]
+            self.pipe_x[rows, slots] = SCREENWIDTH + 10
+            self.upper_y[rows, slots], self.lower_y[rows, slots] = self.get_random_pipes(rows)
+            self.n_pipes[rows] += 1
+
+        # remove first pipe if its out of the screen
+        rows = np.flatnonzero(alive & (self.pipe_x[:, 0] < -PIPE_WIDTH))
+        if len(rows):
+            for pipes, empty in ((self.pipe_x, np.inf), (self.upper_y, 0), (self.lower_y, 0)):
+                pipes[rows, :-1] = pipes[rows, 1:]
+                pipes[rows, -1] = empty
+            self.n_pipes[rows] -= 1
+
+        return crashed, ground, scores > 0
+
+
+def run_batch(agent, episodes, batch_size=1024, max_score=None, seed=None, collision_table=None, episode=None):
+    """
+    Play episodes with a batch of birds, the agent acts for the whole batch in one call.
+    :param agent: QLearning agent, trained as each bird's episode ends if agent.train
+    :param episodes: number of episodes to play
+    :param batch_size: number of birds simulated at once
+    :param max_score: end an episode when reaching this score
+    :param seed: run seed for the sprites and pipes, default agent.seed
+    :param collision_table: CollisionTable to look up pipe collisions
+    :param episode: the episodes are numbered on from this, default agent.episode. Each is recorded by the agent with
+    its number, in the order they finish
+    :return: scores of the episodes in the order they finished
+    """
+    env = BatchFlappyEnv(min(batch_size, episodes), agent.seed if seed is None else seed, collision_table,
+                         agent.episode if episode is None else episode)
+    agent.start_batch(env.n)
+    launched, scores = env.n, []
+    while env.n:
+        actions = agent.act_batch(env.player_x, env.player_y, env.player_vel_y, env.pipe_x, env.lower_y)
+        crashed, _, _ = env.step(actions)
+        done = crashed | (env.score >= max_score) if max_score else crashed
+        if not done.any():
+            continue
+
+        for i in np.flatnonzero(done):
+            score = int(env.score[i])
+            agent.end_batch_episode(i, score, crashed=bool(crashed[i]), episode=int(env.episodes[i]))
+            scores.append(score)
+
+        # start new episodes in place of the finished ones, then drop the birds that are no longer needed
+        restart = np.flatnonzero(done)[:episodes - launched]
+        env.reset(restart)
+        launched += len(restart)
+        if launched == episodes:
+            rows = np.flatnonzero(~done)
+            rows = np.sort(np.concatenate([rows, restart]))
+            if len(rows) < env.n:
+                env.keep(rows)
+                agent.keep_batch(rows)
+    agent.compact_if_due()  # every bird's moves are updated and cleared
+    return scores
@@ -1,83 +1,70 @@
 from itertools import cycle
-from collections import deque
-import copy
-import random
 import sys
+import time
+import numpy as np
 import pygame
 from pygame.locals import *
 
 # Initialize Q-learning agent
 
+from collision_table import CollisionTable
 from config import config
+from flappy_env import FlappyEnv, SnapshotHistory, SCREENWIDTH, SCREENHEIGHT, BASEY, PLAYERS_LIST, PIPES_LIST, \
+    BACKGROUNDS_LIST, HITMASK_PATH, episode_rng, preload_hitmasks
+from profiling import Profiler
 from q_learning import QLearning
+from replay import ReplayBuffer
+from storage import Checkpointer
 
-Agent = QLearning(config['train'])
+Agent = None  # created by main, so that importing this module doesn't load the Q-table
 
-if Agent.train:
-    print("Training agent...")
-else:
-    print("Running agent...")
+
+def initAgent():
+    """Creates the agent from the config, loading the Q-table and training states"""
+    global Agent
+    Agent = QLearning(config['train'], config['seed'], config['spill_moves'])
+
+    if Agent.train:
+        if config['checkpoint_episodes'] or config['checkpoint_seconds']:
+            Agent.checkpointer = Checkpointer(every_episodes=config['checkpoint_episodes'],
+                                              every_seconds=config['checkpoint_seconds'],
+                                              keep=config['checkpoint_keep'], episode=Agent.episode)
+        Agent.compact_visits, Agent.compact_episodes = config['compact_visits'], config['compact_episodes']
+        Agent.compacted_episode = Agent.episode
+        print(f"Training agent, seed {Agent.seed}...")
+    else:
+        print(f"Running agent, seed {Agent.seed}...")
 
 
 # Back to game
 
 FPS = 30
-SCREENWIDTH = 288
-SCREENHEIGHT = 512
-# amount by which base can maximum shift to left
-PIPEGAPSIZE = 100  # gap between upper and lower part of pipe
-BASEY = SCREENHEIGHT * 0.79
-# image, sound and hitmask  dicts
-IMAGES, SOUNDS, HITMASKS = {}, {}, {}
-STATE_HISTORY = deque(maxlen=70)  # 70 is distance between pipes
-REPLAY_BUFFER = []
-
-# list of all possible players (tuple of 3 positions of flap)
-PLAYERS_LIST = (
-    # red bird
-    (
-        'assets/sprites/redbird-upflap.png',
-        'assets/sprites/redbird-midflap.png',
-        'assets/sprites/redbird-downflap.png',
-    ),
-    # blue bird
-    (
-        'assets/sprites/bluebird-upflap.png',
-        'assets/sprites/bluebird-midflap.png',
-        'assets/sprites/bluebird-downflap.png',
-    ),
-    # yellow bird
-    (
-        'assets/sprites/yellowbird-upflap.png',
-        'assets/sprites/yellowbird-midflap.png',
-        'assets/sprites/yellowbird-downflap.png',
-    ),
-)
-
-# list of backgrounds
-BACKGROUNDS_LIST = (
-    'assets/sprites/background-day.png',
-    'assets/sprites/background-night.png',
-)
-
-# list of pipes
-PIPES_LIST = (
-    'assets/sprites/pipe-green.png',
-    'assets/sprites/pipe-red.png',
-)
-
-try:
-    xrange
-except NameError:
-    xrange = range
-
-
-def main():
-    global SCREEN, FPSCLOCK
+EVENT_POLL_INTERVAL = 1000  # frames between event polls when not showing the game
+# image and sound dicts, hitmasks are held by the environment
+IMAGES, SOUNDS = {}, {}
+SCORE_SURFACES = {}  # score -> surface of its digits, drawn once per score value
+DIRTY_RECTS = []  # screen rects drawn on the last frame, restored from the background on the next
+PIPE_RECTS = []  # screen rects of the pipes drawn on the last frame, only restored where the new pipes don't cover them
+PIPE_CORES = []  # (first, last + 1) opaque columns of the upper and lower pipe sprites of this episode
+PIPE_CORES_LIST = []  # PIPE_CORES of every pipe in PIPES_LIST
+STATE_HISTORY = SnapshotHistory(maxlen=70)  # 70 is distance between pipes
+REPLAY_BUFFER = ReplayBuffer(config['replay_bytes'])
+PROFILER = Profiler(config['profile_episodes']) if config['profile'] else None
+PROFILE_PATH = 'data/profile.json'
+
+
+def main(started=None):
+    """Runs the game, started is the time.perf_counter() the process started at to report the time to the first frame"""
+    global SCREEN, FPSCLOCK, ENV, PIPE_CORES_LIST
+    started = time.perf_counter() if started is None else started
+    initAgent()
     pygame.init()
     FPSCLOCK = pygame.time.Clock()
     SCREEN = pygame.display.set_mode((SCREENWIDTH, SCREENHEIGHT))
     pygame.display.set_caption('Flappy Bird')
+    preload_hitmasks(HITMASK_PATH if config['hitmask_cache'] else None)
+    ENV = FlappyEnv(collision_table=CollisionTable() if config['collision_table'] else None)
+    ENV.profiler = PROFILER
 
     # numbers sprites for score display
     IMAGES['numbers'] = (
@@ -100,6 +87,14 @@ def main():
     # base (ground) sprite
     IMAGES['base'] = pygame.image.load('assets/sprites/base.png').convert_alpha()
 
+    # every background, player and pipe sprite is loaded once, an episode only picks from them
+    IMAGES['backgrounds'] = tuple(pygame.image.load(path).convert() for path in BACKGROUNDS_LIST)
+    IMAGES['players'] = tuple(tuple(pygame.image.load(path).convert_alpha() for path in player)
+                              for player in PLAYERS_LIST)
+    IMAGES['pipes'] = tuple((pygame.transform.rotate(pipe, 180), pipe)
+                            for pipe in (pygame.image.load(path).convert_alpha() for path in PIPES_LIST))
+    PIPE_CORES_LIST = [[opaqueColumns(pipeSurface) for pipeSurface in pipes] for pipes in IMAGES['pipes']]
+
     # --- TURN OFF SOUNDS ---
 
     # # sounds
@@ -115,40 +110,33 @@ def main():
     # SOUNDS['wing']   = pygame.mixer.Sound('assets/audio/wing' + soundExt)
 
     while True:
-        # select random background sprites
-        randBg = random.randint(0, len(BACKGROUNDS_LIST) - 1)
-        IMAGES['background'] = pygame.image.load(BACKGROUNDS_LIST[randBg]).convert()
-
-        # select random player sprites
-        randPlayer = random.randint(0, len(PLAYERS_LIST) - 1)
-        IMAGES['player'] = (
-            pygame.image.load(PLAYERS_LIST[randPlayer][0]).convert_alpha(),
-            pygame.image.load(PLAYERS_LIST[randPlayer][1]).convert_alpha(),
-            pygame.image.load(PLAYERS_LIST[randPlayer][2]).convert_alpha(),
-        )
-
-        # select random pipe sprites
-        pipeindex = random.randint(0, len(PIPES_LIST) - 1)
-        IMAGES['pipe'] = (
-            pygame.transform.rotate(pygame.image.load(PIPES_LIST[pipeindex]).convert_alpha(), 180),
-            pygame.image.load(PIPES_LIST[pipeindex]).convert_alpha(),
-        )
-
-        # hismask for pipes
-        HITMASKS['pipe'] = (
-            getHitmask(IMAGES['pipe'][0]),
-            getHitmask(IMAGES['pipe'][1]),
-        )
-
-        # hitmask for player
-        HITMASKS['player'] = (
-            getHitmask(IMAGES['player'][0]),
-            getHitmask(IMAGES['player'][1]),
-            getHitmask(IMAGES['player'][2]),
-        )
+        # the attempts in the replay buffer hold Q-table rows, which compacting renumbers
+        if not len(REPLAY_BUFFER):
+            Agent.compact_if_due()
+
+        # select random background, player and pipe sprites, and the first pipes
+        # a failed retry of a difficult segment doesn't end the episode, so each retry gets its own pipes, numbered by
+        # the attempts in the replay buffer
+        retry = (REPLAY_BUFFER.added,) if REPLAY_BUFFER.added else ()
+        ENV.reset(rng=episode_rng(Agent.seed, Agent.episode + 1, *retry))
+        IMAGES['background'] = IMAGES['backgrounds'][ENV.background]
+        IMAGES['player'] = IMAGES['players'][ENV.player]
+        IMAGES['pipe'] = IMAGES['pipes'][ENV.pipe]
+
+        if config['show_game'] or config['watch']:
+            drawBackground()
+
+        if started is not None:
+            print(f"First frame {time.perf_counter() - started:.2f}s after start")
+            started = None
 
         movementInfo = showWelcomeAnimation()
         crashInfo = mainGame(movementInfo)
+        if PROFILER is not None:
+            profile = PROFILER.end_episode(Agent.episode)
+            print(f"Profile: {profile['frames_per_second']:,.0f} frames/s, "
+                  f"update {profile['update_seconds']:.2f}s ({profile['update_seconds_per_million_moves']:.3f}s per "
+                  f"million moves)")
         showGameOverScreen(crashInfo)
 
 
@@ -219,42 +207,9 @@ def showWelcomeAnimation():
 def mainGame(movementInfo):
 
     # --- REMOVE ANGULAR MOVEMENT AND SOUNDS ---
+    # --- PHYSICS ARE SIMULATED BY FlappyEnv, THIS LOOP ONLY HANDLES THE AGENT, HISTORY AND RENDERING ---
 
-    score = playerIndex = loopIter = 0
-    playerIndexGen = movementInfo['playerIndexGen']
-    playerx, playery = int(SCREENWIDTH * 0.2), movementInfo['playery']
-
-    basex = movementInfo['basex']
-    baseShift = IMAGES['base'].get_width() - IMAGES['background'].get_width()
-
-    # get 2 new pipes to add to upperPipes lowerPipes list
-    newPipe1 = getRandomPipe()
-    newPipe2 = getRandomPipe()
-
-    # list of upper pipes
-    upperPipes = [
-        {'x': SCREENWIDTH + 200, 'y': newPipe1[0]['y']},
-        {'x': SCREENWIDTH + 200 + (SCREENWIDTH / 2), 'y': newPipe2[0]['y']},
-    ]
-
-    # list of lowerpipe
-    lowerPipes = [
-        {'x': SCREENWIDTH + 200, 'y': newPipe1[1]['y']},
-        {'x': SCREENWIDTH + 200 + (SCREENWIDTH / 2), 'y': newPipe2[1]['y']},
-    ]
-
-    pipeVelX = -4
-
-    # player velocity, max velocity, downward accleration, accleration on flap
-    playerVelY = -9  # player's velocity along Y, default same as playerFlapped
-    playerMaxVelY = 10  # max vel along Y, max descend speed
-    playerMinVelY = -8  # min vel along Y, max ascend speed
-    playerAccY = 1  # players downward accleration
-    # playerRot = 45  # player's rotation
-    # playerVelRot = 3  # angular speed
-    # playerRotThr = 20  # rotation threshold
-    playerFlapAcc = -9  # players speed on flapping
-    playerFlapped = False  # True when player flaps
+    ENV.player_y, ENV.basex = movementInfo['playery'], movementInfo['basex']
 
     # When starting the game, if we have state history to resume from then use it until it passes that pipe
     # If history is less than 20 frames this isn't enough for the bird to learn from (loop of dying) so clear the queue
@@ -263,178 +218,195 @@ def mainGame(movementInfo):
     resume_from_history = len(STATE_HISTORY) > 0 if Agent.train else None  # only resume if training
     initial_len_history = len(STATE_HISTORY)
     resume_from = 0
-    current_score = STATE_HISTORY[-1][5] if resume_from_history else None  # reset if beats the latest score in history
+    current_score = STATE_HISTORY.score(-1) if resume_from_history else None  # reset if beats the latest score in history
     print_score = False  # has the current score been printed?
+    frame = 0
+    next_render = 0.0  # perf_counter time the next frame is drawn at in watch mode
+    if PROFILER is not None:
+        PROFILER.start_episode()
 
     while True:
+        if PROFILER is not None:
+            PROFILER.frame()
         if resume_from_history:
             # Load from saved game history
             if resume_from < initial_len_history:
-                if resume_from == 0:
-                    playerx, playery, playerVelY, lowerPipes, upperPipes, score, playerIndex = \
-                        STATE_HISTORY[resume_from]
-                else:
-                    lowerPipes, upperPipes = STATE_HISTORY[resume_from][3], STATE_HISTORY[resume_from][4]
+                STATE_HISTORY.restore(ENV, resume_from, pipes_only=resume_from > 0)
                 resume_from += 1
         else:
             # Save game history for resuming
-            if Agent.train and config['resume_score'] and score >= config['resume_score']:  # only save if training
-                    STATE_HISTORY.append([playerx, playery, playerVelY, copy.deepcopy(lowerPipes),
-                                          copy.deepcopy(upperPipes), score, playerIndex])
-
-        for event in pygame.event.get():
-            if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
-                if print_score:
-                    print('')
-                Agent.save_qvalues()
-                Agent.save_training_states()
-                pygame.quit()
-                sys.exit()
-            if event.type == KEYDOWN and (event.key == K_SPACE or event.key == K_UP):
-                if playery > -2 * IMAGES['player'][0].get_height():
-                    playerVelY = playerFlapAcc
-                    playerFlapped = True
+            if Agent.train and config['resume_score'] and ENV.score >= config['resume_score']:  # only save if training
+                    STATE_HISTORY.record(ENV)
+        if PROFILER is not None:
+            PROFILER.lap('history')
+
+        # In watch mode the game runs uncapped and only the latest frame is drawn at FPS, a frame is not waited for
+        render = config['show_game']
+        if not render and config['watch'] and time.perf_counter() >= next_render:
+            render, next_render = True, time.perf_counter() + 1 / FPS
+
+        # Without the display only poll for ESC/close occasionally, the event pump dominates a headless frame
+        frame += 1
+        if render or frame % EVENT_POLL_INTERVAL == 0:
+            for event in pygame.event.get():
+                if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+                    if print_score:
+                        print('')
+                    Agent.save_qvalues()
+                    Agent.save_training_states()
+                    if Agent.checkpointer is not None:
+                        Agent.checkpointer.close()
+                    if PROFILER is not None:
+                        PROFILER.report(PROFILE_PATH)
+                    pygame.quit()
+                    sys.exit()
+                if event.type == KEYDOWN and (event.key == K_SPACE or event.key == K_UP):
+                    ENV.flap()
                     # SOUNDS['wing'].play()
+        if PROFILER is not None:
+            PROFILER.lap('events')
 
         # Agent to perform an action (0 is do nothing, 1 is flap)
-        if Agent.act(playerx, playery, playerVelY, lowerPipes):
-            if playery > -2 * IMAGES['player'][0].get_height():
-                playerVelY = playerFlapAcc
-                playerFlapped = True
-
-        # check for crash here
-        crashTest = checkCrash({'x': playerx, 'y': playery, 'index': playerIndex},
-                               upperPipes, lowerPipes)
+        action = Agent.act(ENV.player_x, ENV.player_y, ENV.player_vel_y, ENV.lower_pipes)
+        if PROFILER is not None:
+            PROFILER.lap('act')
+
+        # check for crash and score, then move the bird and pipes (held still while loading history)
+        crashTest, scored = ENV.step(action, move_pipes=resume_from >= initial_len_history)
+        score = ENV.score
         if crashTest[0]:
             if print_score:
                 print('')
+            updated = len(Agent.moves)  # moves the Q-table is updated with, for the profile
             if resume_from_history:  # current_score is based on STATE_HISTORY
                 # Managed to pass the difficult pipe
                 if score > current_score:
                     Agent.update_qvalues(score)
                 else:
-                    REPLAY_BUFFER.append(copy.deepcopy(Agent.moves))
+                    REPLAY_BUFFER.add(Agent.moves.copy(), Agent.td_error())
+                    updated = 0
                 # Or stuck in resume loop
-                if score > current_score or len(REPLAY_BUFFER) >= 50:
-                    # Update with a sample of the REPLAY_BUFFER (sample to avoid overfitting)
-                    random.shuffle(REPLAY_BUFFER)
-                    for _ in range(5):
-                        if REPLAY_BUFFER:  # don't pop if list is empty
-                            Agent.moves = REPLAY_BUFFER.pop()
-                            Agent.update_qvalues(current_score)
+                if score > current_score or REPLAY_BUFFER.added >= 50:
+                    # Update with a sample of the REPLAY_BUFFER (sample to avoid overfitting), the attempts that the
+                    # agent was most wrong about are the most likely to be sampled
+                    for moves in REPLAY_BUFFER.sample(5, ENV.rng):
+                        updated += len(moves)
+                        Agent.update_qvalues(current_score, moves)
+                    Agent.moves.clear()  # the failed attempts have been replayed from the buffer
                     STATE_HISTORY.clear()
                     REPLAY_BUFFER.clear()
             else:
                 Agent.update_qvalues(score)  # only updates if training by default
+            if PROFILER is not None:
+                PROFILER.updated(updated)
+                PROFILER.lap('update')
             if Agent.train:
                 print(f"Episode: {Agent.episode}, alpha: {Agent.alpha}, score: {score}, max_score: {Agent.max_score}")
             else:
                 print(f"Episode: {Agent.episode}, score: {score}, max_score: {Agent.max_score}")
-            return {
-                'y': playery,
-                'groundCrash': crashTest[1],
-                'basex': basex,
-                'upperPipes': upperPipes,
-                'lowerPipes': lowerPipes,
-                'score': score,
-                'playerVelY': playerVelY,
-                # 'playerRot': playerRot
-            }
-
-        # check for score
-        playerMidPos = playerx + IMAGES['player'][0].get_width() / 2
-        for pipe in upperPipes:
-            pipeMidPos = pipe['x'] + IMAGES['pipe'][0].get_width() / 2
-            if pipeMidPos <= playerMidPos < pipeMidPos + 4:
-                score += 1
-                # Print every 10k scores
-                if score % config['print_score'] == 0:
-                    print_score = True  # need to start a newline before future prints
-                    print(f"\r {'Training' if Agent.train else 'Running'} agent, "
-                          f"score reached (nearest 10,000): {score:,}", end="")
-                    # sys.stdout.write('\r' + f" {'Training' if Agent.train else 'Running'} "
-                    #                         f"agent, score reached (nearest 10,000): {score}")
-                    # sys.stdout.flush()
-                # SOUNDS['point'].play()
-                if config['max_score'] and score >= config['max_score']:
-                    if print_score:
-                        print('')
-                    Agent.end_episode(score)
-                    STATE_HISTORY.clear()  # don't resume if max score reached
-                    REPLAY_BUFFER.clear()
-                    print(f"Max score of {config['max_score']} reached at episode {Agent.episode}...")
-                    return {
-                        'y': playery,
-                        'groundCrash': crashTest[1],
-                        'basex': basex,
-                        'upperPipes': upperPipes,
-                        'lowerPipes': lowerPipes,
-                        'score': score,
-                        'playerVelY': playerVelY,
-                        # 'playerRot': playerRot
-                    }
-
-        # playerIndex basex change
-        if (loopIter + 1) % 3 == 0:
-            playerIndex = next(playerIndexGen)
-        loopIter = (loopIter + 1) % 30
-        basex = -((-basex + 100) % baseShift)
-
-        # # rotate the player
-        # if playerRot > -90:
-        #     playerRot -= playerVelRot
-
-        # player's movement
-        if playerVelY < playerMaxVelY and not playerFlapped:
-            playerVelY += playerAccY
-        if playerFlapped:
-            playerFlapped = False
-            # # more rotation to cover the threshold (calculated in visible rotation)
-            # playerRot = 45
-
-        playerHeight = IMAGES['player'][playerIndex].get_height()
-        playery += min(playerVelY, BASEY - playery - playerHeight)
-
-        # move pipes to left if done loading
-        if resume_from >= initial_len_history:
-            for uPipe, lPipe in zip(upperPipes, lowerPipes):
-                uPipe['x'] += pipeVelX
-                lPipe['x'] += pipeVelX
-
-        # add new pipe when first pipe is about to touch left of screen
-        if 0 < upperPipes[0]['x'] < 5:
-            newPipe = getRandomPipe()
-            upperPipes.append(newPipe[0])
-            lowerPipes.append(newPipe[1])
-
-        # remove first pipe if its out of the screen
-        if upperPipes[0]['x'] < -IMAGES['pipe'][0].get_width():
-            upperPipes.pop(0)
-            lowerPipes.pop(0)
-
-        if config['show_game']:
-            # draw sprites
-            SCREEN.blit(IMAGES['background'], (0, 0))
-
-            for uPipe, lPipe in zip(upperPipes, lowerPipes):
-                SCREEN.blit(IMAGES['pipe'][0], (uPipe['x'], uPipe['y']))
-                SCREEN.blit(IMAGES['pipe'][1], (lPipe['x'], lPipe['y']))
-
-            SCREEN.blit(IMAGES['base'], (basex, BASEY))
-            # print score so player overlaps the score
-            showScore(score)
-
-            # # Player rotation has a threshold
-            # visibleRot = playerRotThr
-            # if playerRot <= playerRotThr:
-            #     visibleRot = playerRot
-            # playerSurface = pygame.transform.rotate(IMAGES['player'][playerIndex], visibleRot)
-
-            playerSurface = IMAGES['player'][playerIndex]
-            SCREEN.blit(playerSurface, (playerx, playery))
-
-            pygame.display.update()
-            FPSCLOCK.tick(FPS)
+            return getCrashInfo(crashTest)
+
+        if scored:
+            # Print every 10k scores
+            if score % config['print_score'] == 0:
+                print_score = True  # need to start a newline before future prints
+                print(f"\r {'Training' if Agent.train else 'Running'} agent, "
+                      f"score reached (nearest 10,000): {score:,}", end="")
+            # SOUNDS['point'].play()
+            if config['max_score'] and score >= config['max_score']:
+                if print_score:
+                    print('')
+                updated = len(Agent.moves)
+                Agent.end_episode(score)
+                if PROFILER is not None:
+                    PROFILER.updated(updated)
+                    PROFILER.lap('update')
+                STATE_HISTORY.clear()  # don't resume if max score reached
+                REPLAY_BUFFER.clear()
+                print(f"Max score of {config['max_score']} reached at episode {Agent.episode}...")
+                return getCrashInfo(crashTest)
+
+        if render:
+            drawFrame(score)
+            if PROFILER is not None:
+                PROFILER.lap('render')
+            if config['show_game']:
+                FPSCLOCK.tick(FPS)
+                if PROFILER is not None:
+                    PROFILER.lap('tick')
+
+
+def drawBackground():
+    """Draw the whole screen over the background of a new episode, frames after it only update what they draw"""
+    global DIRTY_RECTS, PIPE_RECTS, PIPE_CORES
+    SCREEN.blit(IMAGES['background'], (0, 0))
+    pygame.display.update()
+    DIRTY_RECTS, PIPE_RECTS = [], []
+    PIPE_CORES = PIPE_CORES_LIST[ENV.pipe]
+
+
+def opaqueColumns(surface):
+    """Returns the (first, last + 1) columns of a sprite that are opaque from top to bottom"""
+    columns = np.flatnonzero((pygame.surfarray.array_alpha(surface) == 255).all(axis=1))
+    return (int(columns[0]), int(columns[-1]) + 1) if len(columns) else (0, 0)
+
+
+def uncoveredStrips(rect, cores):
+    """Returns the parts of rect not covered by an opaque core spanning the same rows, as strips of columns"""
+    for core in cores:
+        if core.top == rect.top and core.bottom == rect.bottom and core.colliderect(rect):
+            strips = []
+            if rect.left < core.left:
+                strips.append(pygame.Rect(rect.left, rect.top, core.left - rect.left, rect.height))
+            if rect.right > core.right:
+                strips.append(pygame.Rect(core.right, rect.top, rect.right - core.right, rect.height))
+            return strips
+    return [rect]
+
+
+def drawFrame(score):
+    """Draws the sprites of the current frame, only the rects drawn on this frame and the last are updated"""
+    global DIRTY_RECTS, PIPE_RECTS
+    screenRect = SCREEN.get_rect()
+    pipes = [(IMAGES['pipe'][i], pipe, PIPE_CORES[i])
+             for uPipe, lPipe in zip(ENV.upper_pipes, ENV.lower_pipes) for i, pipe in enumerate((uPipe, lPipe))]
+
+    # restore the background under the sprites of the last frame, the pipes only move along x so most of their last
+    # rect is drawn over by the opaque core of the same pipe
+    background = IMAGES['background']
+    cores = [screenRect.clip(pygame.Rect(int(pipe['x']) + first, int(pipe['y']), last - first,
+                                         pipeSurface.get_height()))
+             for pipeSurface, pipe, (first, last) in pipes]
+    restored = [strip for rect in PIPE_RECTS for strip in uncoveredStrips(rect, cores)] + DIRTY_RECTS
+    for rect in restored:
+        SCREEN.blit(background, rect, rect)
+
+    pipeRects = [SCREEN.blit(pipeSurface, (pipe['x'], pipe['y'])) for pipeSurface, pipe, _ in pipes]
+
+    # the base covers the whole of its rect so it never needs restoring
+    baseRect = SCREEN.blit(IMAGES['base'], (ENV.basex, BASEY))
+    # print score so player overlaps the score
+    rects = [showScore(score)]
+
+    playerSurface = IMAGES['player'][ENV.player_index]
+    rects.append(SCREEN.blit(playerSurface, (ENV.player_x, ENV.player_y)))
+
+    pygame.display.update(restored + pipeRects + rects + [baseRect])
+    DIRTY_RECTS, PIPE_RECTS = rects, pipeRects
+
+
+def getCrashInfo(crashTest):
+    """Returns the end of episode info used by showGameOverScreen"""
+    return {
+        'y': ENV.player_y,
+        'groundCrash': crashTest[1],
+        'basex': ENV.basex,
+        'upperPipes': ENV.upper_pipes,
+        'lowerPipes': ENV.lower_pipes,
+        'score': ENV.score,
+        'playerVelY': ENV.player_vel_y,
+        # 'playerRot': playerRot
+    }
 
 
 def showGameOverScreen(crashInfo):
@@ -462,6 +434,10 @@ def showGameOverScreen(crashInfo):
             if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
                 Agent.save_qvalues()
                 Agent.save_training_states()
+                if Agent.checkpointer is not None:
+                    Agent.checkpointer.close()
+                if PROFILER is not None:
+                    PROFILER.report(PROFILE_PATH)
                 pygame.quit()
                 sys.exit()
             if event.type == KEYDOWN and (event.key == K_SPACE or event.key == K_UP):
@@ -513,96 +489,28 @@ def showGameOverScreen(crashInfo):
 #         playerShm['val'] -= 1
 
 
-def getRandomPipe():
-    """Returns a randomly generated pipe"""
-    # y of gap between upper and lower pipe
-    gapY = random.randrange(0, int(BASEY * 0.6 - PIPEGAPSIZE))
-    gapY += int(BASEY * 0.2)
-    pipeHeight = IMAGES['pipe'][0].get_height()
-    pipeX = SCREENWIDTH + 10
-
-    return [
-        {'x': pipeX, 'y': gapY - pipeHeight},  # upper pipe
-        {'x': pipeX, 'y': gapY + PIPEGAPSIZE},  # lower pipe
-    ]
-
-
 def showScore(score):
-    """Displays score in center of screen"""
-    scoreDigits = [int(x) for x in list(str(score))]
-    totalWidth = 0  # total width of all numbers to be printed
-
-    for digit in scoreDigits:
-        totalWidth += IMAGES['numbers'][digit].get_width()
-
-    Xoffset = (SCREENWIDTH - totalWidth) / 2
-
-    for digit in scoreDigits:
-        SCREEN.blit(IMAGES['numbers'][digit], (Xoffset, SCREENHEIGHT * 0.1))
-        Xoffset += IMAGES['numbers'][digit].get_width()
-
-
-def checkCrash(player, upperPipes, lowerPipes):
-    """Returns True if player collders with base or pipes."""
-    pi = player['index']
-    player['w'] = IMAGES['player'][0].get_width()
-    player['h'] = IMAGES['player'][0].get_height()
-
-    # if player crashes into ground
-    if player['y'] + player['h'] >= BASEY - 1:
-        return [True, True]
-    else:
-
-        playerRect = pygame.Rect(player['x'], player['y'],
-                                 player['w'], player['h'])
-        pipeW = IMAGES['pipe'][0].get_width()
-        pipeH = IMAGES['pipe'][0].get_height()
-
-        for uPipe, lPipe in zip(upperPipes, lowerPipes):
-            # upper and lower pipe rects
-            uPipeRect = pygame.Rect(uPipe['x'], uPipe['y'], pipeW, pipeH)
-            lPipeRect = pygame.Rect(lPipe['x'], lPipe['y'], pipeW, pipeH)
-
-            # player and upper/lower pipe hitmasks
-            pHitMask = HITMASKS['player'][pi]
-            uHitmask = HITMASKS['pipe'][0]
-            lHitmask = HITMASKS['pipe'][1]
-
-            # if bird collided with upipe or lpipe
-            uCollide = pixelCollision(playerRect, uPipeRect, pHitMask, uHitmask)
-            lCollide = pixelCollision(playerRect, lPipeRect, pHitMask, lHitmask)
-
-            if uCollide or lCollide:
-                return [True, False]
-
-    return [False, False]
-
-
-def pixelCollision(rect1, rect2, hitmask1, hitmask2):
-    """Checks if two objects collide and not just their rects"""
-    rect = rect1.clip(rect2)
+    """Displays score in center of screen, returns the rect drawn"""
+    scoreSurface = SCORE_SURFACES.get(score)
+    if scoreSurface is None:
+        scoreDigits = [int(x) for x in list(str(score))]
+        totalWidth = 0  # total width of all numbers to be printed
 
-    if rect.width == 0 or rect.height == 0:
-        return False
+        for digit in scoreDigits:
+            totalWidth += IMAGES['numbers'][digit].get_width()
 
-    x1, y1 = rect.x - rect1.x, rect.y - rect1.y
-    x2, y2 = rect.x - rect2.x, rect.y - rect2.y
+        scoreSurface = pygame.Surface((totalWidth, IMAGES['numbers'][0].get_height()), SRCALPHA)
+        Xoffset = 0
 
-    for x in xrange(rect.width):
-        for y in xrange(rect.height):
-            if hitmask1[x1 + x][y1 + y] and hitmask2[x2 + x][y2 + y]:
-                return True
-    return False
+        for digit in scoreDigits:
+            scoreSurface.blit(IMAGES['numbers'][digit], (Xoffset, 0))
+            Xoffset += IMAGES['numbers'][digit].get_width()
 
+        if len(SCORE_SURFACES) >= 1024:  # the score only goes up, keep the recent ones
+            SCORE_SURFACES.clear()
+        SCORE_SURFACES[score] = scoreSurface
 
-def getHitmask(image):
-    """Returns a hitmask using an image's alpha."""
-    mask = []
-    for x in xrange(image.get_width()):
-        mask.append([])
-        for y in xrange(image.get_height()):
-            mask[x].append(bool(image.get_at((x, y))[3]))
-    return mask
+    return SCREEN.blit(scoreSurface, ((SCREENWIDTH - scoreSurface.get_width()) / 2, SCREENHEIGHT * 0.1))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from collision_table import CollisionTable
+from config import config
+from flappy_env import HITMASK_PATH, preload_hitmasks, run_batch
+from q_learning import N_STATES, QLearning
+from storage import Checkpointer
+
+
+class SharedQTable:
+    """
+    Dense Q-table in shared memory, indexed directly by state key so that processes never need to agree on rows.
+
+    Q values are updated by every process without locks, a lost update only costs one step towards the same value.
+    Visits are counted by each process in its own row of visits, so no count is lost, and summed when saved. Row 0 holds
+    the visits loaded from file.
+    """
+    def __init__(self, workers, name=None):
+        """
+        Create the shared Q-table, or attach to an existing one.
+        :param workers: number of worker processes
+        :param name: shared memory name of an existing table, None to create one
+        """
+        self.workers = workers
+        layout = (("q_values", (N_STATES, 2), np.float64),
+                  ("visits", (workers + 1, N_STATES), np.uint32),
+                  ("seen", (N_STATES,), np.bool_))
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in layout)
+        # new shared memory is zero filled, the same as a newly seen state
+        self.memory = shared_memory.SharedMemory(name, create=name is None, size=size if name is None else 0)
+        self.name = self.memory.name
+        offset = 0
+        for attr, shape, dtype in layout:
+            array = np.ndarray(shape, dtype, self.memory.buf, offset)
+            setattr(self, attr, array)
+            offset += array.nbytes
+
+    def unlink(self):
+        """Free the shared memory once every process is done with it."""
+        self.memory.unlink()
+
+
+class SharedQLearning(QLearning):
+    """
+    Q-learning agent training the Q-table of a SharedQTable.
+
+    The Q-table row of a state is its key. Worker 0 is the process that loads the Q-table and training states and
+    saves them, the other workers only train.
+    """
+    def __init__(self, train, table, worker=0, seed=None, spill_moves=None):
+        """
+        Initialise the agent
+        :param train: train or run
+        :param table: SharedQTable
+        :param worker: worker number, from 1 for the training processes
+        :param seed: run seed, see QLearning
+        :param spill_moves: moves of an episode held in memory, see QLearning
+        """
+        self.table, self.worker = table, worker
+        super().__init__(train, seed, spill_moves)
+        if worker:
+            self.played = []  # handed to worker 0 to log, see train_worker
+
+    def load_qvalues(self):
+        """Attach to the shared Q-table, loading q values from file into it for worker 0."""
+        self.state_keys = np.arange(N_STATES)
+        self.q_values, self.visits, self.seen = self.table.q_values, self.table.visits[self.worker], self.table.seen
+        if self.worker == 0:
+            qtable = self.read_qvalues()
+            if qtable is not None:
+                keys, q_values, visits = qtable
+                self.q_values[keys], self.visits[keys], self.seen[keys] = q_values, visits, True
+
+    def init_qvalues(self, state):
+        """
+        Mark the state as seen.
+        :param state: current state key
+        :return: Q-table row of the state, the state key
+        """
+        self.seen[state] = True
+        return state
+
+    def load_training_states(self):
+        """Load current training state from the training log for worker 0, the others are counted by worker 0."""
+        if self.worker == 0:
+            super().load_training_states()
+
+    def state_count(self):
+        """Number of states seen by any worker."""
+        return int(np.count_nonzero(self.seen))
+
+    def snapshot(self):
+        """
+        Copy the seen states of the Q-table, with the visits of every worker summed.
+        :return: snapshot for storage.Checkpointer
+        """
+        keys = np.flatnonzero(self.seen)
+        visits = self.table.visits[:, keys].sum(axis=0)
+        return {'episode': self.episode, 'keys': keys, 'q_values': self.q_values[keys],
+                'visits': np.minimum(visits, np.iinfo(np.uint32).max).astype(np.uint32), 'log': self.log_index(),
+                'log_file': self.log}
+
+
+def train_worker(name, workers, worker, alpha, seed, counter, episodes, batch_size, results, stop):
+    """
+    Train on the shared Q-table until stopped, putting the scores of every run of episodes on the results queue.
+    :param name: shared memory name of the SharedQTable
+    :param workers: number of worker processes
+    :param worker: worker number, from 1
+    :param alpha: learning rate
+    :param seed: run seed
+    :param counter: shared count of the episodes handed out to the workers, each run of episodes takes the next
+    numbers so that every episode is played with episode_rng(seed, episode) of its own global number
+    :param episodes: episodes played between results
+    :param batch_size: number of birds simulated at once
+    :param results: queue of lists of (episode, score, frames, alpha) of the episodes played
+    :param stop: event set to stop training
+    """
+    agent = SharedQLearning(True, SharedQTable(workers, name), worker, seed, config['spill_moves'])
+    agent.alpha = alpha
+    collision_table = CollisionTable() if config['collision_table'] else None
+    preload_hitmasks(HITMASK_PATH if config['hitmask_cache'] else None)
+    try:
+        while not stop.is_set():
+            with counter.get_lock():
+                first, counter.value = counter.value, counter.value + episodes
+            run_batch(agent, episodes, batch_size, config['max_score'], collision_table=collision_table, episode=first)
+            results.put(agent.played.copy())
+            agent.played.clear()  # episodes are logged by worker 0
+    except KeyboardInterrupt:
+        pass
+
+
+def train(workers=None, episodes=None, batch_size=256, report_episodes=1000, seed=None):
+    """
+    Train worker processes on one Q-table in shared memory, saving it when done or on ctrl+c.
+    :param workers: number of worker processes, default the number of CPUs
+    :param episodes: stop after this many episodes, None to train until ctrl+c
+    :param batch_size: number of birds each worker simulates at once
+    :param report_episodes: episodes each worker plays between reporting scores
+    :param seed: run seed for the sprites and pipes, None to carry on with the seed of the training states
+    """
+    workers = workers or os.cpu_count()
+    if config['collision_table']:
+        CollisionTable()  # compute and save the table once rather than in every worker
+    preload_hitmasks(HITMASK_PATH if config['hitmask_cache'] else None)
+    table = SharedQTable(workers)
+    try:
+        agent = SharedQLearning(True, table, seed=seed)
+        if config['checkpoint_episodes'] or config['checkpoint_seconds']:
+            agent.checkpointer = Checkpointer(every_episodes=config['checkpoint_episodes'],
+                                              every_seconds=config['checkpoint_seconds'],
+                                              keep=config['checkpoint_keep'], episode=agent.episode)
+        print(f"Training agent with {workers} workers, seed {agent.seed}...")
+
+        results, stop = multiprocessing.Queue(), multiprocessing.Event()
+        counter = multiprocessing.Value('q', agent.episode)
+        processes = [multiprocessing.Process(target=train_worker, daemon=True,
+                                             args=(table.name, workers, worker, agent.alpha, agent.seed, counter,
+                                                   report_episodes, batch_size, results, stop))
+                     for worker in range(1, workers + 1)]
+        for process in processes:
+            process.start()
+
+        def record(played):
+            states = agent.state_count()  # once per result, counting reads the whole table
+            for episode, score, frames, alpha in played:
+                agent.record_episode(score, frames, alpha, states, episode)
+
+        start_episode, start = agent.episode, time.perf_counter()
+        try:
+            while episodes is None or agent.episode - start_episode < episodes:
+                record(results.get())
+                agent.checkpoint()
+                print(f"Episode: {agent.episode}, max_score: {agent.max_score}, "
+                      f"{(agent.episode - start_episode) / (time.perf_counter() - start):.0f} episodes/s")
+        except KeyboardInterrupt:
+            print('')
+
+        # workers can't exit until their results are read
+        stop.set()
+        while any(process.is_alive() for process in processes):
+            try:
+                record(results.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        for process in processes:
+            process.join()
+        while not results.empty():
+            record(results.get())
+
+        agent.save_qvalues()
+        agent.save_training_states()
+        if agent.checkpointer is not None:
+            agent.checkpointer.close()
+    finally:
+        table.unlink()
+
+
+if __name__ == '__main__':
+    # Train with the given number of workers (default the number of CPUs) for the given number of episodes
+    train(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,120 @@
+from collections import deque
+from time import perf_counter_ns
+
+from storage import save_json
+
+
+class Profiler:
+    """
+    Wall-clock time of each phase of the game loop, per episode and over a rolling window of episodes.
+
+    The loop calls lap(phase) after each phase, which adds the time since the previous lap to that phase, so timing a
+    phase costs one read of the monotonic clock and the phases of an episode add up to its whole run time.
+    """
+    def __init__(self, window=100):
+        """
+        Initialise an empty profile
+        :param window: number of recent episodes the rolling aggregates are over
+        """
+        self.phases = {}  # phase -> ns this episode, in the order the phases are first seen
+        self.frames = self.moves = 0  # frames and moves updated this episode
+        self.last = perf_counter_ns()
+        self.recent = deque(maxlen=window)  # (episode, frames, moves, phases) of each recent episode
+        self.run = {'episodes': 0, 'frames': 0, 'moves': 0, 'phases': {}}  # totals over the whole run, in ns
+
+    def start_episode(self):
+        """Start timing an episode, the time since the last lap is not counted."""
+        self.phases = dict.fromkeys(self.phases, 0)
+        self.frames = self.moves = 0
+        self.last = perf_counter_ns()
+
+    def frame(self):
+        """Count a frame."""
+        self.frames += 1
+
+    def lap(self, phase):
+        """
+        Add the time since the previous lap to a phase.
+        :param phase: name of the phase that just ended
+        """
+        now = perf_counter_ns()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.last = now
+
+    def updated(self, moves):
+        """
+        Count moves updated by the Q-table update, time the update itself with lap('update').
+        :param moves: number of moves
+        """
+        self.moves += moves
+
+    def end_episode(self, episode):
+        """
+        Close an episode and add it to the rolling and run aggregates.
+        :param episode: episode number
+        :return: summary of the episode, see summarise
+        """
+        self.recent.append((episode, self.frames, self.moves, self.phases))
+        self.run['episodes'] += 1
+        self.run['frames'] += self.frames
+        self.run['moves'] += self.moves
+        for phase, ns in self.phases.items():
+            self.run['phases'][phase] = self.run['phases'].get(phase, 0) + ns
+        return {'episode': episode, **self.summarise(self.frames, self.moves, self.phases)}
+
+    @staticmethod
+    def summarise(frames, moves, phases):
+        """
+        Rates of a stretch of the run.
+        :param frames: frames played
+        :param moves: moves updated
+        :param phases: phase -> ns
+        :return: dict of frames, frames_per_second, us_per_frame of each phase other than the update, update_seconds and
+        update_seconds_per_million_moves
+        """
+        update = phases.get('update', 0)
+        total = sum(phases.values())
+        return {'frames': frames, 'seconds': total / 1e9,
+                'frames_per_second': frames / (total - update) * 1e9 if total > update else 0.0,
+                'us_per_frame': {phase: ns / frames / 1e3 if frames else 0.0
+                                 for phase, ns in phases.items() if phase != 'update'},
+                'update_seconds': update / 1e9,
+                'update_seconds_per_million_moves': update / moves * 1e6 / 1e9 if moves else 0.0}
+
+    def rolling(self):
+        """
+        Aggregate of the recent episodes.
+        :return: summarise() of the episodes in the window
+        """
+        frames = moves = 0
+        phases = {}
+        for _, episode_frames, episode_moves, episode_phases in self.recent:
+            frames += episode_frames
+            moves += episode_moves
+            for phase, ns in episode_phases.items():
+                phases[phase] = phases.get(phase, 0) + ns
+        return {'episodes': len(self.recent), **self.summarise(frames, moves, phases)}
+
+    def report(self, path=None):
+        """
+        Print a table of the run and rolling aggregates, and save them with the recent episodes.
+        :param path: json file to save the summary to, None to only print it
+        :return: the summary
+        """
+        run = {'episodes': self.run['episodes'],
+               **self.summarise(self.run['frames'], self.run['moves'], self.run['phases'])}
+        rolling = self.rolling()
+        print(f"{'':<10}{'run':>12}{'rolling':>12}  (over {run['episodes']} and the last {rolling['episodes']} "
+              f"episodes)")
+        print(f"{'frames/s':<10}{run['frames_per_second']:>12,.0f}{rolling['frames_per_second']:>12,.0f}")
+        for phase, us in run['us_per_frame'].items():
+            print(f"{phase + ' µs':<10}{us:>12.2f}{rolling['us_per_frame'].get(phase, 0.0):>12.2f}")
+        print(f"{'update s':<10}{run['update_seconds']:>12.2f}{rolling['update_seconds']:>12.2f}")
+        print(f"{'s per 1M':<10}{run['update_seconds_per_million_moves']:>12.3f}"
+              f"{rolling['update_seconds_per_million_moves']:>12.3f}")
+        summary = {'run': run, 'rolling': rolling,
+                   'episodes': [{'episode': episode, **self.summarise(frames, moves, phases)}
+                                for episode, frames, moves, phases in self.recent]}
+        if path:
+            save_json(path, summary)
+        return summary
@@ -1,20 +1,134 @@
 import json
+import os
 import random
 
+import numpy as np
+
+from storage import TrainingLog, convert_json_qtable, load_qtable, save_qtable
+from trajectory import Trajectory
+
+# Discretised state values, a state (x0, y0, vel, y1) is packed into one integer from the position of each value
+X_BUCKETS = (*range(-49, -40), *range(-40, 140, 10), *range(140, 701, 70))
+Y_BUCKETS = (*range(-600, -179, 60), *range(-170, 180, 10), *range(180, 601, 60))
+VEL_BUCKETS = tuple(range(-9, 11))
+X_INDEX, Y_INDEX, VEL_INDEX = ({value: i for i, value in enumerate(buckets)}
+                               for buckets in (X_BUCKETS, Y_BUCKETS, VEL_BUCKETS))
+N_STATES = len(X_BUCKETS) * len(Y_BUCKETS) * len(VEL_BUCKETS) * len(Y_BUCKETS)
+
+STATE_CACHE_SIZE = 2 ** 18  # raw states remembered by get_state before the cache is cleared
+QTABLE_PATH = "data/q_values_resume.qtable"  # binary Q-table loaded and saved by the agent
+
+
+def bucket_x(x0):
+    """
+    Discretise the x distance to the next pipe, finer close to the pipe.
+    :param x0: whole x distance
+    :return: x0 bucket
+    """
+    if x0 < -40:
+        return x0
+    elif x0 < 140:
+        return x0 - (x0 % 10)
+    return x0 - (x0 % 70)
+
+
+def bucket_y(y):
+    """
+    Discretise a y distance to a pipe, finer close to the gap.
+    :param y: whole y distance
+    :return: y bucket
+    """
+    if -180 < y < 180:
+        return y - (y % 10)
+    return y - (y % 60)
+
+
+# Lookup tables from every whole distance, offset by the first bucket, to the position of its bucket
+X_RAW_INDEX = [X_INDEX[bucket_x(x0)] for x0 in range(X_BUCKETS[0], X_BUCKETS[-1] + 70)]
+Y_RAW_INDEX = [Y_INDEX[bucket_y(y)] for y in range(Y_BUCKETS[0], Y_BUCKETS[-1] + 60)]
+# and as arrays for the vectorised get_states
+X_LOOKUP, Y_LOOKUP = np.array(X_RAW_INDEX, dtype=np.int64), np.array(Y_RAW_INDEX, dtype=np.int64)
+
+
+def encode_state(x0, y0, vel, y1):
+    """
+    Pack a discretised state into an integer key.
+    :param x0: x0 bucket
+    :param y0: y0 bucket
+    :param vel: bird y velocity
+    :param y1: y1 bucket
+    :return: state key
+    """
+    try:
+        return ((X_INDEX[x0] * len(Y_BUCKETS) + Y_INDEX[y0]) * len(VEL_BUCKETS) + VEL_INDEX[vel]) * len(Y_BUCKETS) + \
+            Y_INDEX[y1]
+    except KeyError:
+        raise ValueError(f"State {x0}_{y0}_{vel}_{y1} is outside of the state buckets") from None
+
+
+def raw_state_key(x0, y0, vel, y1):
+    """
+    Pack a whole, not yet discretised state into an integer key with the lookup tables, same as
+    encode_state(bucket_x(x0), bucket_y(y0), vel, bucket_y(y1)).
+    :param x0: whole x distance to pipe0
+    :param y0: whole y distance to pipe0
+    :param vel: bird y velocity
+    :param y1: whole y distance to pipe1
+    :return: state key
+    """
+    x0_i, y0_i, y1_i = x0 - X_BUCKETS[0], y0 - Y_BUCKETS[0], y1 - Y_BUCKETS[0]
+    if not (0 <= x0_i < len(X_RAW_INDEX) and 0 <= y0_i < len(Y_RAW_INDEX) and 0 <= y1_i < len(Y_RAW_INDEX)
+            and vel in VEL_INDEX):
+        raise ValueError(f"State {x0}_{y0}_{vel}_{y1} is outside of the state buckets")
+    return ((X_RAW_INDEX[x0_i] * len(Y_BUCKETS) + Y_RAW_INDEX[y0_i]) * len(VEL_BUCKETS) + VEL_INDEX[vel]) * \
+        len(Y_BUCKETS) + Y_RAW_INDEX[y1_i]
+
+
+def decode_state(key):
+    """
+    Unpack an integer state key.
+    :param key: state key
+    :return: (x0, y0, vel, y1)
+    """
+    key, y1 = divmod(int(key), len(Y_BUCKETS))
+    key, vel = divmod(key, len(VEL_BUCKETS))
+    x0, y0 = divmod(key, len(Y_BUCKETS))
+    return X_BUCKETS[x0], Y_BUCKETS[y0], VEL_BUCKETS[vel], Y_BUCKETS[y1]
+
+
+def state_name(key):
+    """State key as the x0_y0_v_y1 string used by the json Q-tables."""
+    return "_".join(str(value) for value in decode_state(key))
+
+
+def parse_state(name):
+    """State key from an x0_y0_v_y1 string used by the json Q-tables."""
+    return encode_state(*(int(value) for value in name.split("_")))
+
 
 class QLearning:
     """
     A Q-Learning agent.
 
-    Load the Q-Learning agent Q-table (data/q_values.json) and training states (data/training_values.json) from file .
+    Load the Q-Learning agent Q-table (QTABLE_PATH data/q_values_resume.qtable, or data/q_values_resume.json before its
+    first save) and training states (data/training_values.json) from file .
     To train a new agent specify new file names to load and save to.
     """
-    def __init__(self, train):
+    def __init__(self, train, seed=None, spill_moves=None, log_path="data/training_log.bin"):
         """
         Initialise the agent
         :param train: train or run
+        :param seed: run seed every episode's sprites and pipes are drawn from, see flappy_env.episode_rng. None to
+        carry on with the seed of the loaded training states, or a random seed
+        :param spill_moves: moves of an episode held in memory before spilling them to disk, see Trajectory. None to
+        hold every move in memory and update the q values of the oldest early with reduce_moves
+        :param log_path: training log the training states are loaded from and episodes appended to when training, None
+        to neither load training states nor log episodes
         """
         self.train = train  # train or run
+        self.seed = seed
+        self.spill_moves = spill_moves
+        self.log_path = log_path
         self.discount_factor = 0.95  # q-learning discount factor
         self.alpha = 0.7  # learning rate
         # self.epsilon = 0.1  # chance to explore vs take local optimum
@@ -27,47 +141,172 @@ class QLearning:
         # Save states
         self.episode = 0
         self.previous_action = 0
-        self.previous_state = "0_0_0_0"  # initial position (x0, y0, vel, y1)
-        self.moves = []
-        self.scores = []
+        self.previous_state = 0  # Q-table row of the initial position (x0, y0, vel, y1) = (0, 0, 0, 0)
+        self.moves = Trajectory(spill=spill_moves)
+        self.batch_previous_states, self.batch_previous_actions, self.batch_moves = [], [], []  # per bird of a batch
+        # list of (episode, score, frames, alpha) of the episodes ended since it was last emptied, None to not keep them
+        self.played = None
         self.max_score = 0
+        self.log = None  # storage.TrainingLog of every episode, opened with the training states
+        self.checkpointer = None  # storage.Checkpointer to save periodic checkpoints while training
+        self.compact_visits = None  # compact the Q-table while training, see compact_if_due
+        self.compact_episodes = None
+        self.compacted_episode = 0
 
         # Load states, add states to q-table as they are experienced rather than pre-initializing q-table
-        self.q_values = {}  # q-table[state][action] decides which action to take by comparing q-values
+        # Each state seen gets a row of preallocated arrays, grown in chunks as more states are experienced
+        self.states = {}  # state key -> row
+        self.state_cache = {}  # raw (x0, y0, vel, y1) of get_state -> row, cleared when rows are renumbered
+        self.state_keys = np.zeros(0, dtype=np.int64)  # row -> state key
+        self.q_values = np.zeros((0, 2))  # q-table[row][action] decides which action to take by comparing q-values
+        self.visits = np.zeros(0, dtype=np.uint32)  # times experienced each state
         self.load_qvalues()
+        self.previous_state = self.init_qvalues(encode_state(0, 0, 0, 0))
         self.load_training_states()
+        if self.seed is None:
+            self.seed = np.random.SeedSequence().entropy
 
-    def load_qvalues(self):
-        """Load q values and from json file."""
-        print("Loading Q-table states from json file...")
+    @staticmethod
+    def read_qvalues():
+        """
+        Read q values from the binary Q-table, importing the json Q-table if there is no binary one yet. The import is
+        saved as the binary Q-table so that only the first start parses the json.
+        :return: (keys, q_values, visits) arrays, None if there is no Q-table
+        """
         try:
-            with open("data/q_values_resume.json", "r") as f:
-                self.q_values = json.load(f)
+            print("Loading Q-table states from file...")
+            return load_qtable(QTABLE_PATH)
         except IOError:
-            self.init_qvalues(self.previous_state)
+            try:
+                print("Loading Q-table states from json file...")
+                return load_qtable(convert_json_qtable("data/q_values_resume.json"))
+            except IOError:
+                return None
+
+    def load_qvalues(self):
+        """Load q values from file."""
+        qtable = self.read_qvalues()
+        if qtable is None:
+            return
+        keys, q_values, visits = qtable
+        n = len(keys)
+        self.allocate_qvalues(n)
+        self.state_keys[:n], self.q_values[:n], self.visits[:n] = keys, q_values, visits
+        self.states = dict(zip(keys.tolist(), range(n)))
+        self.state_cache.clear()
+
+    def allocate_qvalues(self, capacity, chunk=16384):
+        """
+        Grow the Q-table arrays to hold at least capacity states, rounded up to a whole chunk.
+        :param capacity: number of states to hold
+        :param chunk: states allocated at a time
+        """
+        capacity = -(-capacity // chunk) * chunk
+        if capacity > len(self.state_keys):
+            n = len(self.states)
+            for name in ("state_keys", "q_values", "visits"):
+                old = getattr(self, name)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:n] = old[:n]
+                setattr(self, name, new)
 
     def init_qvalues(self, state):
         """
         Initialise q values if state not yet seen.
-        :param state: current state
+        :param state: current state key
+        :return: Q-table row of the state
         """
-        if self.q_values.get(state) is None:
-            self.q_values[state] = [0, 0, 0]  # [Q of no action, Q of flap action, Times experienced this state]
+        row = self.states.get(state)
+        if row is None:
+            # [Q of no action, Q of flap action] and times experienced this state all start at 0
+            row = len(self.states)
+            if row == len(self.state_keys):
+                self.allocate_qvalues(row + 1)
+            self.states[state] = row
+            self.state_keys[row] = state
+        return row
+
+    def compact(self, min_visits, keep_policy=True):
+        """
+        Evict states visited fewer than min_visits times, the rows of the kept states are renumbered. Only call between
+        episodes, when no trajectory holds Q-table rows, an evicted state seen again starts over at 0 like a new state.
+        :param min_visits: states visited fewer times are evicted
+        :param keep_policy: only evict states whose greedy action is the default action (do nothing) of a new state, so
+        the policy is unchanged, otherwise evict every state below min_visits
+        :return: dict of states before and after, bytes_saved in the Q-table file and policy agreement, the fraction of
+        states and of visits whose greedy action is the same after compacting
+        """
+        n = len(self.states)
+        q_values, visits = self.q_values[:n], self.visits[:n]
+        flap = q_values[:, 0] < q_values[:, 1]  # greedy action, as in act
+        keep = visits >= min_visits
+        if keep_policy:
+            keep |= flap
+        # the states the agent acts from next are never evicted
+        keep[[self.previous_state, *self.batch_previous_states]] = True
+
+        rows = np.full(n, -1, dtype=np.int64)
+        rows[keep] = np.arange(np.count_nonzero(keep))
+        m = int(rows.max()) + 1
+        changed = flap & ~keep
+        report = {'states_before': n, 'states_after': m,
+                  'bytes_saved': (n - m) * (self.state_keys.itemsize + self.q_values[0].nbytes + self.visits.itemsize),
+                  'policy_agreement': 1 - np.count_nonzero(changed) / n if n else 1.0,
+                  'visit_agreement': 1 - float(visits[changed].sum() / visits.sum()) if visits.sum() else 1.0}
+
+        state_keys, q_values, visits = self.state_keys[:n][keep], q_values[keep], visits[keep]
+        self.states = dict(zip(state_keys.tolist(), range(m)))
+        self.state_keys, self.q_values, self.visits = state_keys, q_values, visits
+        self.allocate_qvalues(m)
+        self.state_cache.clear()  # the cached rows are renumbered
+        self.previous_state = int(rows[self.previous_state])
+        self.batch_previous_states = rows[self.batch_previous_states].tolist()
+        return report
+
+    def compact_if_due(self):
+        """
+        Compact the Q-table every compact_episodes episodes when compact_visits is set, keeping the policy. Only call
+        between episodes, when no trajectory holds Q-table rows.
+        """
+        if not self.compact_visits or not self.compact_episodes or \
+                self.episode - self.compacted_episode < self.compact_episodes:
+            return
+        self.compacted_episode = self.episode
+        report = self.compact(self.compact_visits)
+        print(f"Compacted Q-table from {report['states_before']} to {report['states_after']} states, "
+              f"{report['bytes_saved']:,} bytes saved")
 
     def load_training_states(self):
-        """Load current training state from json file."""
-        if self.train:
-            print("Loading training states from json file...")
-            try:
-                with open("data/training_values_resume.json", "r") as f:
-                    training_state = json.load(f)
-                    self.episode = training_state['episodes'][-1]
-                    self.scores = training_state['scores']
-                    self.alpha = max(self.alpha - self.alpha_decay * self.episode, 0.1)
-                    # self.epsilon = max(self.epsilon - self.epsilon_decay * self.episode, 0)
-                    self.max_score = max(self.scores)
-            except IOError:
-                pass
+        """Load current training state from the index of the training log, only the index is read."""
+        if self.train and self.log_path is not None:
+            print("Loading training states from training log...")
+            new_log = not os.path.exists(self.log_path)
+            self.log = TrainingLog(self.log_path)
+            if new_log:
+                self.import_training_values("data/training_values_resume.json")
+            index = self.log.index
+            if index['records']:
+                self.episode = index['episode']
+                self.alpha = max(self.alpha - self.alpha_decay * self.episode, 0.1)
+                # self.epsilon = max(self.epsilon - self.epsilon_decay * self.episode, 0)
+                self.max_score = index['max_score']
+                if self.seed is None:
+                    self.seed = index['seeds'][-1]
+
+    def import_training_values(self, path):
+        """
+        Import the episodes of a json training states file into the new training log, alpha and frames weren't saved.
+        :param path: training_values json file
+        """
+        try:
+            with open(path, "r") as f:
+                training_state = json.load(f)
+        except IOError:
+            return
+        print("Importing training states from json file...")
+        for episode, score in zip(training_state['episodes'], training_state['scores']):
+            self.log.append(episode, score, float('nan'), 0, training_state.get('seed'))
+        self.log.flush()
 
     def act(self, x, y, vel, pipe):
         """
@@ -81,7 +320,7 @@ class QLearning:
         # store the transition from previous state to current state
         state = self.get_state(x, y, vel, pipe)
         if self.train:
-            self.moves.append((self.previous_state, self.previous_action, state))  # add the experience to history
+            self.moves.append(self.previous_state, self.previous_action, state)  # add the experience to history
             self.reduce_moves()
             self.previous_state = state  # update the last_state with the current state
 
@@ -92,44 +331,104 @@ class QLearning:
             #     return self.previous_action
 
         # Best action with respect to current state, default is 0 (do nothing), 1 is flap
-        self.previous_action = 0 if self.q_values[state][0] >= self.q_values[state][1] else 1
+        self.previous_action = 0 if self.q_values[state, 0] >= self.q_values[state, 1] else 1
 
         return self.previous_action
 
-    def update_qvalues(self, score):
+    def start_batch(self, n):
+        """
+        Start acting for a batch of n birds, each bird keeps its own previous state and history.
+        :param n: number of birds
+        """
+        self.batch_previous_states = [self.previous_state] * n
+        self.batch_previous_actions = [0] * n
+        self.batch_moves = [Trajectory(spill=self.spill_moves) for _ in range(n)]
+
+    def act_batch(self, x, y, vel, pipe_x, pipe_y):
+        """
+        Agent performs an action for every bird of a batch, see BatchFlappyEnv.
+        :param x: bird x, shared by all birds
+        :param y: array of bird y
+        :param vel: array of bird y velocity
+        :param pipe_x: (n, pipes) array of pipe x ordered left to right, empty slots are inf
+        :param pipe_y: (n, pipes) array of lower pipe y
+        :return: array of actions to take (do nothing or flap)
+        """
+        states = [self.init_qvalues(key) for key in self.get_states(x, y, vel, pipe_x, pipe_y).tolist()]
+        if self.train:
+            for moves, previous_state, previous_action, state in zip(self.batch_moves, self.batch_previous_states,
+                                                                     self.batch_previous_actions, states):
+                moves.append(previous_state, previous_action, state)
+                if len(moves) > 1000000:
+                    self.reduce_moves(moves=moves)
+            self.batch_previous_states = states
+
+        # Best action with respect to current state, default is 0 (do nothing), 1 is flap
+        actions = (self.q_values[states, 0] < self.q_values[states, 1]).astype(np.int8)
+        self.batch_previous_actions = actions.tolist()
+        return actions
+
+    def end_batch_episode(self, i, score, crashed=True, episode=None):
+        """
+        Update the q values with the history of one bird of the batch.
+        :param i: index of the bird
+        :param score: score for this episode
+        :param crashed: the bird died, otherwise the max score was reached
+        :param episode: number the bird's episode was played with, see BatchFlappyEnv.episodes
+        """
+        self.moves = self.batch_moves[i]  # cleared by the update and reused for the bird's next episode
+        if crashed:
+            self.update_qvalues(score, episode=episode)
+        else:
+            self.end_episode(score, episode)
+
+    def keep_batch(self, rows):
+        """
+        Keep only some of the birds of the batch, see BatchFlappyEnv.keep.
+        :param rows: indices of the birds to keep, in their new order
+        """
+        self.batch_previous_states = [self.batch_previous_states[i] for i in rows]
+        self.batch_previous_actions = [self.batch_previous_actions[i] for i in rows]
+        self.batch_moves = [self.batch_moves[i] for i in rows]
+
+    def update_qvalues(self, score, moves=None, episode=None):
         """
         Update q values using history.
         :param score: score for this episode
+        :param moves: Trajectory to update with and clear, default self.moves, e.g. a sample of a ReplayBuffer
+        :param episode: number the episode was played with, see record_episode
         """
-        self.episode += 1
-        self.scores.append(score)
-        self.max_score = max(score, self.max_score)
+        moves = self.moves if moves is None else moves
+        self.record_episode(score, len(moves), episode=episode)
 
         if self.train:
-            history = list(reversed(self.moves))
             # Flag if the bird died in the top pipe, don't flap if this is the case
-            high_death_flag = True if int(history[0][2].split("_")[1]) > 120 else False
+            high_death_flag = True if decode_state(self.state_keys[moves.last_state()])[1] > 120 else False
+            # memoryviews index the arrays with python floats, much faster than numpy scalars in this loop
+            q_values, visits = memoryview(self.q_values), memoryview(self.visits)
             t, last_flap = 0, True
-            for move in history:
-                t += 1
-                state, action, new_state = move
-                self.q_values[state][2] += 1  # number of times this state has been seen
-                curr_reward = self.reward[0]
-                # Select reward
-                if t <= 2:
-                    # Penalise last 2 states before dying
-                    curr_reward = self.reward[1]
-                    if action:
+            # walk the history backwards from the death, a block at a time if it was spilled to disk
+            for states, actions in moves.blocks():
+                for i in range(len(actions) - 1, -1, -1):
+                    t += 1
+                    state, action, new_state = states[i], actions[i], states[i + 1]
+                    visits[state] += 1  # number of times this state has been seen
+                    curr_reward = self.reward[0]
+                    # Select reward
+                    if t <= 2:
+                        # Penalise last 2 states before dying
+                        curr_reward = self.reward[1]
+                        if action:
+                            last_flap = False
+                    elif (last_flap or high_death_flag) and action:
+                        # Penalise flapping
+                        curr_reward = self.reward[1]
                         last_flap = False
-                elif (last_flap or high_death_flag) and action:
-                    # Penalise flapping
-                    curr_reward = self.reward[1]
-                    last_flap = False
-                    high_death_flag = False
+                        high_death_flag = False
 
-                self.q_values[state][action] = (1 - self.alpha) * (self.q_values[state][action]) + \
-                                               self.alpha * (curr_reward + self.discount_factor *
-                                                             max(self.q_values[new_state][0:2]))
+                    q_values[state, action] = (1 - self.alpha) * (q_values[state, action]) + \
+                        self.alpha * (curr_reward + self.discount_factor *
+                                      max(q_values[new_state, 0], q_values[new_state, 1]))
 
             # Decay values for convergence
             if self.alpha > 0.1:
@@ -139,7 +438,22 @@ class QLearning:
 
             # Don't need to reset previous action or state since this doesn't matter for all the beginning states
             # Although wikipedia mentions a reset of initial conditions tends to predict human behaviour more accurately
-            self.moves = []  # clear history after updating strategies
+            moves.clear()  # clear history after updating strategies
+            self.checkpoint()
+
+    def td_error(self, moves=None):
+        """
+        Absolute TD error of the move into the death, the priority of a failed attempt in a ReplayBuffer.
+        :param moves: Trajectory of the attempt, default self.moves
+        :return: |death reward + discounted best q value of the new state - q value of the move|
+        """
+        moves = self.moves if moves is None else moves
+        if not len(moves):
+            return 0.0
+        states, actions = next(moves.blocks())  # the last block holds the last move
+        state, action, new_state = states[-2], actions[-1], states[-1]
+        target = self.reward[1] + self.discount_factor * max(self.q_values[new_state, 0], self.q_values[new_state, 1])
+        return abs(float(target - self.q_values[state, action]))
 
     def get_state(self, x, y, vel, pipe):
         """
@@ -148,7 +462,8 @@ class QLearning:
         :param y: bird y
         :param vel: bird y velocity
         :param pipe: pipe
-        :return: current state (x0_y0_v_y1) where x0 and y0 are diff to pipe0 and y1 is diff to pipe1
+        :return: Q-table row of the current state (x0, y0, v, y1) where x0 and y0 are diff to pipe0 and y1 is diff to
+        pipe1
         """
 
         # Get pipe coordinates
@@ -160,74 +475,135 @@ class QLearning:
 
         x0 = pipe0["x"] - x
         y0 = pipe0["y"] - y
-        if -50 < x0 <= 0:
-            y1 = pipe1["y"] - y
-        else:
-            y1 = 0
+        y1 = pipe1["y"] - y if -50 < x0 <= 0 else 0
 
-        # Evaluate player position compared to pipe
-        if x0 < -40:
-            x0 = int(x0)
-        elif x0 < 140:
-            x0 = int(x0) - (int(x0) % 10)
-        else:
-            x0 = int(x0) - (int(x0) % 70)
+        # Distances are bucketed by their whole part, so the row only depends on the truncated values
+        raw = (int(x0), int(y0), int(vel), int(y1))
+        row = self.state_cache.get(raw)
+        if row is None:
+            if len(self.state_cache) >= STATE_CACHE_SIZE:
+                self.state_cache.clear()
+            row = self.state_cache[raw] = self.init_qvalues(raw_state_key(*raw))
+        return row
 
-        if -180 < y0 < 180:
-            y0 = int(y0) - (int(y0) % 10)
-        else:
-            y0 = int(y0) - (int(y0) % 60)
-
-        if -180 < y1 < 180:
-            y1 = int(y1) - (int(y1) % 10)
-        else:
-            y1 = int(y1) - (int(y1) % 60)
+    @staticmethod
+    def get_states(x, y, vel, pipe_x, pipe_y):
+        """
+        Vectorised get_state for a batch of birds.
+        :param x: bird x, shared by all birds
+        :param y: array of bird y
+        :param vel: array of bird y velocity
+        :param pipe_x: (n, pipes) array of pipe x ordered left to right, empty slots are inf
+        :param pipe_y: (n, pipes) array of lower pipe y
+        :return: array of current state keys
+        """
+        # Get pipe coordinates, skip the first pipe once the bird has passed it
+        rows = np.arange(len(y))
+        passed = x - pipe_x[:, 0] >= 50
+        next_pipe = np.where(passed & np.isfinite(pipe_x[:, 2]), 2, 1) if pipe_x.shape[1] > 2 else 1
+        x0 = pipe_x[rows, passed.astype(int)] - x
+        y0 = pipe_y[rows, passed.astype(int)] - y
+        y1 = np.where((-50 < x0) & (x0 <= 0), pipe_y[rows, next_pipe] - y, 0)
 
-        state = str(int(x0)) + "_" + str(int(y0)) + "_" + str(int(vel)) + "_" + str(int(y1))
-        self.init_qvalues(state)
-        return state
+        # Evaluate player position compared to pipe, truncated as int() in get_state and bucketed by the lookup tables
+        x0 = X_LOOKUP[np.trunc(x0).astype(np.int64) - X_BUCKETS[0]]
+        y0 = Y_LOOKUP[np.trunc(y0).astype(np.int64) - Y_BUCKETS[0]]
+        y1 = Y_LOOKUP[np.trunc(y1).astype(np.int64) - Y_BUCKETS[0]]
+        vel = np.trunc(vel).astype(np.int64) - VEL_BUCKETS[0]
+        return ((x0 * len(Y_BUCKETS) + y0) * len(VEL_BUCKETS) + vel) * len(Y_BUCKETS) + y1
 
-    def reduce_moves(self, reduce_len=1000000):
+    def reduce_moves(self, reduce_len=1000000, moves=None):
         """
-        Reduce length of moves if greater than reduce_len.
+        Reduce length of moves if greater than reduce_len, unless they are spilled to disk instead.
         :param reduce_len: reduce moves in memory if greater than this length, default 1 million
+        :param moves: Trajectory to reduce, default self.moves
+        """
+        moves = self.moves if moves is None else moves
+        if moves.spill is None and len(moves) > reduce_len:
+            self.update_zero_reward(moves, reduce_len)
+            moves.drop(reduce_len)
+
+    def end_episode(self, score, episode=None):
+        """
+        End the run for this episode.
+        :param score: score for this episode
+        :param episode: number the episode was played with, see record_episode
+        """
+        self.record_episode(score, len(self.moves), episode=episode)
+        if self.train:
+            self.update_zero_reward(self.moves, len(self.moves))
+            self.moves.clear()
+            self.checkpoint()
+
+    def record_episode(self, score, frames, alpha=None, states=None, episode=None):
+        """
+        Count an episode and append it to the training log.
+        :param score: score of the episode
+        :param frames: frames played, the moves of the episode
+        :param alpha: learning rate the episode was learnt with, default the current alpha
+        :param states: number of states in the Q-table, default counted with state_count
+        :param episode: number the episode was played with, episode_rng(seed, episode) plays it again. Default the count
+        of episodes, the number the game plays the next episode with
         """
-        if len(self.moves) > reduce_len:
-            history = list(reversed(self.moves[:reduce_len]))
-            for move in history:
-                state, action, new_state = move
-                # Save q_values with default of 0 reward (bird not yet died)
-                self.q_values[state][action] = (1 - self.alpha) * (self.q_values[state][action]) + \
-                                               self.alpha * (self.reward[0] + self.discount_factor *
-                                                             max(self.q_values[new_state][0:2]))
-            self.moves = self.moves[reduce_len:]
-
-    def end_episode(self, score):
-        """End the run for this episode."""
+        alpha = self.alpha if alpha is None else alpha
         self.episode += 1
-        self.scores.append(score)
+        episode = self.episode if episode is None else episode
+        if self.played is not None:
+            self.played.append((episode, score, frames, alpha))
         self.max_score = max(score, self.max_score)
-        if self.train:
-            history = list(reversed(self.moves))
-            for move in history:
-                state, action, new_state = move
-                # Save q_values with default of 0 reward (bird not yet died)
-                self.q_values[state][action] = (1 - self.alpha) * (self.q_values[state][action]) + \
-                                               self.alpha * (self.reward[0] + self.discount_factor *
-                                                             max(self.q_values[new_state][0:2]))
-            self.moves = []
+        if self.log is not None:
+            self.log.append(episode, score, alpha, frames, self.seed, self.state_count() if states is None else states)
+
+    def state_count(self):
+        """Number of states in the Q-table."""
+        return len(self.states)
+
+    def update_zero_reward(self, moves, n):
+        """
+        Update q values with the default of 0 reward (bird not yet died), walking the moves backwards.
+        :param moves: Trajectory
+        :param n: number of moves from the front of the trajectory to update with
+        """
+        q_values = memoryview(self.q_values)
+        for states, actions in moves.blocks(n):
+            for i in range(len(actions) - 1, -1, -1):
+                state, action, new_state = states[i], actions[i], states[i + 1]
+                q_values[state, action] = (1 - self.alpha) * (q_values[state, action]) + \
+                    self.alpha * (self.reward[0] + self.discount_factor *
+                                  max(q_values[new_state, 0], q_values[new_state, 1]))
+
+    def snapshot(self):
+        """
+        Copy the Q-table and training states, cheap enough to take between episodes.
+        :return: snapshot for storage.Checkpointer
+        """
+        n = len(self.states)
+        return {'episode': self.episode, 'keys': self.state_keys[:n].copy(), 'q_values': self.q_values[:n].copy(),
+                'visits': self.visits[:n].copy(), 'log': self.log_index(), 'log_file': self.log}
+
+    def log_index(self):
+        """Copy of the index of the training log, None if not logging, the episodes it counts may not be saved yet."""
+        if self.log is None:
+            return None
+        return dict(self.log.index, seeds=list(self.log.index['seeds']))
+
+    def checkpoint(self):
+        """
+        Hand a snapshot to the checkpointer if a checkpoint is due, it is saved on a background thread.
+        Raises the exception of the last checkpoint if it failed.
+        """
+        if self.checkpointer is not None and self.checkpointer.due(self.episode):
+            self.checkpointer.save(self.snapshot())
 
     def save_qvalues(self):
-        """Save q values to json file."""
+        """Save q values to the binary Q-table."""
         if self.train:
-            print(f"Saving Q-table with {len(self.q_values.keys())} states to file...")
-            with open("data/q_values_resume.json", "w") as f:
-                json.dump(self.q_values, f)
+            snapshot = self.snapshot()
+            print(f"Saving Q-table with {len(snapshot['keys'])} states to file...")
+            save_qtable(QTABLE_PATH, snapshot['keys'], snapshot['q_values'], snapshot['visits'])
 
     def save_training_states(self):
-        if self.train:
-            """Save current training state to json file."""
-            print(f"Saving training states with {self.episode} episodes to file...")
-            with open("data/training_values_resume.json", "w") as f:
-                json.dump({'episodes': [i+1 for i in range(self.episode)],
-                           'scores': self.scores}, f)
+        if self.train and self.log is not None:
+            """Save the episodes appended to the training log since the last save."""
+            print(f"Saving training log with {self.episode} episodes to file...")
+            self.log.flush()
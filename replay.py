@@ -0,0 +1,95 @@
+from collections import deque
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    Bounded replay buffer of Trajectory objects, sampled in proportion to their priority.
+
+    Priorities are held in a sum tree so adding, removing and sampling an attempt are O(log n). Once the buffer holds
+    max_entries attempts or max_bytes of moves the oldest attempts are evicted. Sampled attempts are taken out of the
+    buffer, like popping from a shuffled list.
+    """
+    def __init__(self, max_bytes=256 * 2 ** 20, max_entries=1024, alpha=0.6, epsilon=1.0):
+        """
+        Initialise an empty buffer
+        :param max_bytes: bytes of moves held before evicting the oldest attempts
+        :param max_entries: attempts held before evicting the oldest
+        :param alpha: how much the priorities count, 0 samples uniformly
+        :param epsilon: added to every priority so that no attempt is never sampled
+        """
+        self.max_bytes, self.max_entries, self.alpha, self.epsilon = max_bytes, max_entries, alpha, epsilon
+        self.tree = np.zeros(2 * max_entries)  # tree[1] is the total, the leaves of each slot start at max_entries
+        self.entries = [None] * max_entries
+        self.ids = [0] * max_entries  # id of the attempt in each slot, to skip stale slots in the eviction order
+        self.order = deque()  # (slot, id) oldest first
+        self.free = list(range(max_entries - 1, -1, -1))
+        self.nbytes = 0
+        self.added = 0  # attempts added since the buffer was last cleared, including evicted and sampled ones
+
+    def __len__(self):
+        return self.max_entries - len(self.free)
+
+    def add(self, trajectory, priority):
+        """
+        Add an attempt, evicting the oldest to make room.
+        :param trajectory: Trajectory of the attempt, not copied
+        :param priority: e.g. QLearning.td_error() of the attempt
+        """
+        while len(self) and (len(self) == self.max_entries or self.nbytes + trajectory.nbytes() > self.max_bytes):
+            slot, attempt = self.order.popleft()
+            if self.ids[slot] == attempt:
+                self.remove(slot)
+        self.added += 1
+        slot = self.free.pop()
+        self.entries[slot], self.ids[slot] = trajectory, self.added
+        self.order.append((slot, self.added))
+        self.nbytes += trajectory.nbytes()
+        self.set_priority(slot, (priority + self.epsilon) ** self.alpha)
+
+    def set_priority(self, slot, priority):
+        """Set the priority of a slot and the sums above it."""
+        i = slot + self.max_entries
+        self.tree[i] = priority
+        i //= 2
+        while i:
+            self.tree[i] = self.tree[2 * i] + self.tree[2 * i + 1]
+            i //= 2
+
+    def remove(self, slot):
+        """
+        Take an attempt out of the buffer.
+        :param slot: slot of the attempt
+        :return: Trajectory of the attempt
+        """
+        trajectory = self.entries[slot]
+        self.entries[slot], self.ids[slot] = None, 0
+        self.nbytes -= trajectory.nbytes()
+        self.set_priority(slot, 0.0)
+        self.free.append(slot)
+        return trajectory
+
+    def sample(self, k, rng=None):
+        """
+        Take k attempts out of the buffer, each drawn in proportion to its priority.
+        :param k: number of attempts, fewer if the buffer holds fewer
+        :param rng: numpy random Generator
+        :return: list of Trajectory
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        sampled = []
+        for _ in range(min(k, len(self))):
+            # walk down the sum tree to the leaf the drawn value falls in
+            value, i = rng.random() * self.tree[1], 1
+            while i < self.max_entries:
+                i *= 2
+                if value >= self.tree[i] and self.tree[i + 1] > 0:
+                    value -= self.tree[i]
+                    i += 1
+            sampled.append(self.remove(i - self.max_entries))
+        return sampled
+
+    def clear(self):
+        """Drop every attempt."""
+        self.__init__(self.max_bytes, self.max_entries, self.alpha, self.epsilon)
@@ -0,0 +1,325 @@
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Binary Q-table: header, then state keys (int64), Q of no action/flap (float32 or float64) and visits (uint32)
+QTABLE_MAGIC = b'FQTB'
+QTABLE_VERSION = 1
+QTABLE_HEADER = struct.Struct('<4sHBxQ')  # magic, version, bytes per Q value, number of states
+
+# Training log: header, then one record per episode
+TRAINING_LOG_MAGIC = b'FTLG'
+TRAINING_LOG_VERSION = 2
+TRAINING_LOG_HEADER = struct.Struct('<4sHH')  # magic, version, bytes per record
+# episode, score, alpha, frames, end time, seed (position in the index), Q-table states
+TRAINING_LOG_RECORD = struct.Struct('<QQdQdII')
+TRAINING_LOG_DTYPE = np.dtype([('episode', '<u8'), ('score', '<u8'), ('alpha', '<f8'), ('frames', '<u8'),
+                               ('time', '<f8'), ('seed', '<u4'), ('states', '<u4')])
+
+
+def save_qtable(path, keys, q_values, visits, dtype=np.float64):
+    """
+    Save a Q-table in the binary format, atomically by writing a temporary file and renaming it.
+    :param path: file to save to
+    :param keys: state keys
+    :param q_values: (n, 2) Q of no action and flap action
+    :param visits: times experienced each state
+    :param dtype: float32 or float64 Q values
+    """
+    dtype = np.dtype(dtype)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(QTABLE_HEADER.pack(QTABLE_MAGIC, QTABLE_VERSION, dtype.itemsize, len(keys)))
+        f.write(np.ascontiguousarray(keys, dtype='<i8').tobytes())
+        f.write(np.ascontiguousarray(q_values, dtype=dtype.newbyteorder('<')).tobytes())
+        f.write(np.ascontiguousarray(visits, dtype='<u4').tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_qtable(path):
+    """
+    Load a binary Q-table through a read-only memory map, nothing is copied until the arrays are used.
+    :param path: file to load
+    :return: (keys, q_values, visits) read-only arrays
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < QTABLE_HEADER.size:
+            raise ValueError(f"{path} is not a Q-table file")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, itemsize, n = QTABLE_HEADER.unpack_from(buffer)
+    if magic != QTABLE_MAGIC:
+        raise ValueError(f"{path} is not a Q-table file")
+    if version != QTABLE_VERSION:
+        raise ValueError(f"{path} is Q-table version {version}, only version {QTABLE_VERSION} is supported")
+    if size != QTABLE_HEADER.size + n * (8 + 2 * itemsize + 4):
+        raise ValueError(f"{path} is truncated")
+
+    offset = QTABLE_HEADER.size
+    keys = np.frombuffer(buffer, dtype='<i8', count=n, offset=offset)
+    offset += keys.nbytes
+    q_values = np.frombuffer(buffer, dtype=f'<f{itemsize}', count=2 * n, offset=offset).reshape(n, 2)
+    offset += q_values.nbytes
+    visits = np.frombuffer(buffer, dtype='<u4', count=n, offset=offset)
+    return keys, q_values, visits
+
+
+def load_json_qtable(path):
+    """
+    Load a json Q-table of {"x0_y0_vel_y1": [Q of no action, Q of flap action, visits]}.
+    :param path: file to load
+    :return: (keys, q_values, visits) arrays
+    """
+    from q_learning import parse_state  # q_learning saves and loads through this module
+
+    with open(path, "r") as f:
+        q_table = json.load(f)
+    keys = np.fromiter((parse_state(name) for name in q_table), dtype=np.int64, count=len(q_table))
+    q_values = np.array([values[:2] for values in q_table.values()], dtype=np.float64).reshape(-1, 2)
+    visits = np.array([values[2] for values in q_table.values()], dtype=np.uint32)
+    return keys, q_values, visits
+
+
+def convert_json_qtable(path, dtype=np.float64):
+    """
+    Convert a json Q-table to the binary format next to it.
+    :param path: json file
+    :param dtype: float32 or float64 Q values
+    :return: path of the binary Q-table
+    """
+    qtable_path = os.path.splitext(path)[0] + ".qtable"
+    save_qtable(qtable_path, *load_json_qtable(path), dtype=dtype)
+    return qtable_path
+
+
+def save_json(path, data):
+    """
+    Save json atomically by writing a temporary file and renaming it.
+    :param path: file to save to
+    :param data: json serialisable data
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_training_values(path, episode, scores, seed=None):
+    """
+    Save training states in the training_values json format.
+    :param path: file to save to
+    :param episode: number of episodes
+    :param scores: score of every episode
+    :param seed: run seed the episodes were played with, see flappy_env.episode_rng
+    """
+    training_values = {'episodes': [i+1 for i in range(episode)], 'scores': scores}
+    if seed is not None:
+        training_values['seed'] = seed
+    save_json(path, training_values)
+
+
+class TrainingLog:
+    """
+    Append-only binary log of every training episode, fixed-size TRAINING_LOG_RECORD records after a header.
+
+    The index next to the log (<log>.json) holds the number of records, the highest episode number, the max score and
+    the run seeds, so resuming only reads the index and appending an episode writes one record. Records past the count
+    of the index, written after the last flush or by a run resumed from an older checkpoint index, are dropped on open.
+
+    Appended records are written through to the file every few seconds without saving the index, so the dashboard can
+    tail the log while training. A reader tailing the log only trusts whole records.
+    """
+    def __init__(self, path="data/training_log.bin", write_seconds=1.0):
+        """
+        Open the log for appending, creating it if missing
+        :param path: log file, the index is saved next to it
+        :param write_seconds: write the appended records to the file every this many seconds, None to only on flush
+        """
+        self.path, self.index_path = path, os.path.splitext(path)[0] + ".json"
+        self.write_seconds, self.last_write = write_seconds, time.monotonic()
+        try:
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        except IOError:
+            self.index = {'records': 0, 'episode': 0, 'max_score': 0, 'seeds': []}
+
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        self.file = open(path, mode)
+        if mode == "w+b":
+            self.file.write(TRAINING_LOG_HEADER.pack(TRAINING_LOG_MAGIC, TRAINING_LOG_VERSION,
+                                                     TRAINING_LOG_RECORD.size))
+        else:
+            self.check_header(self.file.read(TRAINING_LOG_HEADER.size), path)
+        self.file.truncate(TRAINING_LOG_HEADER.size + self.index['records'] * TRAINING_LOG_RECORD.size)
+        self.file.seek(0, os.SEEK_END)
+
+    @staticmethod
+    def check_header(header, path):
+        """Raise ValueError if header isn't the header of a training log."""
+        if len(header) < TRAINING_LOG_HEADER.size:
+            raise ValueError(f"{path} is not a training log")
+        magic, version, record_size = TRAINING_LOG_HEADER.unpack(header)
+        if magic != TRAINING_LOG_MAGIC or record_size != TRAINING_LOG_RECORD.size:
+            raise ValueError(f"{path} is not a training log")
+        if version != TRAINING_LOG_VERSION:
+            raise ValueError(f"{path} is training log version {version}, only version {TRAINING_LOG_VERSION} is "
+                             f"supported")
+
+    def append(self, episode, score, alpha, frames, seed, states=0):
+        """
+        Append an episode, it is saved by the next flush.
+        :param episode: episode number
+        :param score: score of the episode
+        :param alpha: learning rate the episode was learnt with
+        :param frames: frames played
+        :param seed: run seed, see flappy_env.episode_rng
+        :param states: number of states in the Q-table after the episode
+        """
+        seeds = self.index['seeds']
+        if not seeds or seeds[-1] != seed:
+            seeds.append(seed)
+        self.file.write(TRAINING_LOG_RECORD.pack(episode, score, alpha, frames, time.time(), len(seeds) - 1,
+                                                 min(states, 0xffffffff)))
+        if self.write_seconds is not None and time.monotonic() - self.last_write >= self.write_seconds:
+            self.file.flush()
+            self.last_write = time.monotonic()
+        index = self.index
+        index['records'] += 1
+        if episode > index['episode']:
+            index['episode'] = episode  # episodes of a batch end out of order, resuming numbers on from the last
+        if score > index['max_score']:
+            index['max_score'] = score
+
+    def sync(self):
+        """Save the appended episodes to disk, without the index."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def flush(self):
+        """Save the appended episodes and then the index, so the index never counts records that weren't saved."""
+        self.sync()
+        save_json(self.index_path, self.index)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    @staticmethod
+    def read(path="data/training_log.bin"):
+        """
+        Read the episodes of a log without opening it for appending.
+        :param path: log file
+        :return: (TRAINING_LOG_DTYPE records, index), the records are a read-only memory map
+        """
+        with open(os.path.splitext(path)[0] + ".json", "r") as f:
+            index = json.load(f)
+        with open(path, "rb") as f:
+            TrainingLog.check_header(f.read(TRAINING_LOG_HEADER.size), path)
+        if not index['records']:
+            return np.zeros(0, dtype=TRAINING_LOG_DTYPE), index
+        return np.memmap(path, dtype=TRAINING_LOG_DTYPE, mode='r', offset=TRAINING_LOG_HEADER.size,
+                         shape=(index['records'],)), index
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints of the Q-table and training states, written on a background thread.
+
+    Checkpoints are saved as q_values_<episode>.qtable and training_log_<episode>.json, the index of the training log
+    at that episode, and only the latest few are kept. To resume from one, copy them over data/q_values_resume.qtable
+    and data/training_log.json, the log drops the episodes after the checkpoint when it is next opened.
+    """
+    def __init__(self, directory="data/checkpoints", every_episodes=100, every_seconds=600, keep=3, episode=0):
+        """
+        Initialise the checkpointer
+        :param directory: directory to save checkpoints to
+        :param every_episodes: checkpoint after this many episodes, None to not checkpoint by episode
+        :param every_seconds: checkpoint after this many seconds, None to not checkpoint by time
+        :param keep: number of checkpoints to keep, at least 1
+        :param episode: episode training starts from
+        """
+        if keep < 1:
+            raise ValueError(f"Checkpointer must keep at least 1 checkpoint, not {keep}")
+        self.directory = directory
+        self.every_episodes, self.every_seconds, self.keep = every_episodes, every_seconds, keep
+        self.last_episode, self.last_time = episode, time.monotonic()
+        self.thread = None
+        self.error = None  # exception of the last write, raised by the next due or close
+        os.makedirs(directory, exist_ok=True)
+
+    def due(self, episode):
+        """
+        Check if a checkpoint is due, never while the previous checkpoint is still being written.
+        :param episode: current episode
+        """
+        self.raise_error()
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        return bool(self.every_episodes and episode - self.last_episode >= self.every_episodes or
+                    self.every_seconds and time.monotonic() - self.last_time >= self.every_seconds)
+
+    def save(self, snapshot):
+        """
+        Write a snapshot on a background thread.
+        :param snapshot: QLearning.snapshot()
+        """
+        self.last_episode, self.last_time = snapshot['episode'], time.monotonic()
+        self.thread = threading.Thread(target=self.write, args=(snapshot,), daemon=True)
+        self.thread.start()
+
+    def write(self, snapshot):
+        """Save a snapshot and remove old checkpoints, keeping the exception for the training thread."""
+        try:
+            self.write_snapshot(snapshot)
+        except Exception as e:
+            self.error = e
+
+    def write_snapshot(self, snapshot):
+        episode = snapshot['episode']
+        save_qtable(os.path.join(self.directory, f"q_values_{episode}.qtable"),
+                    snapshot['keys'], snapshot['q_values'], snapshot['visits'])
+        if snapshot['log'] is not None:
+            # save the episodes the index counts here rather than on the training thread
+            snapshot['log_file'].sync()
+            save_json(os.path.join(self.directory, f"training_log_{episode}.json"), snapshot['log'])
+
+        episodes = sorted(int(match.group(1)) for match in
+                          (re.fullmatch(r"q_values_(\d+)\.qtable", name) for name in os.listdir(self.directory))
+                          if match)
+        for old in episodes[:-self.keep]:
+            for name in (f"q_values_{old}.qtable", f"training_log_{old}.json"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def raise_error(self):
+        """Raise the exception of the last checkpoint written, if it failed."""
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Wait for the checkpoint being written, if any, raising its exception if it failed."""
+        if self.thread is not None:
+            self.thread.join()
+        self.raise_error()
+
+
+if __name__ == '__main__':
+    # Convert the given json Q-tables, default all of data/q_values*.json
+    for json_path in sys.argv[1:] or sorted(glob.glob("data/q_values*.json")):
+        print(f"Converted {json_path} ({os.path.getsize(json_path):,} bytes) to "
+              f"{convert_json_qtable(json_path)} ({os.path.getsize(os.path.splitext(json_path)[0] + '.qtable'):,} bytes)")
@@ -0,0 +1,151 @@
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class Trajectory:
+    """
+    History of (state, action, new state) moves held in preallocated arrays that grow in chunks.
+
+    The agent always acts from the state it reached last, so the new state of a move is the state of the next move and
+    only one state and one action are stored per move: states[i], actions[i] and states[i + 1] form move i. Moves are
+    dropped from the front by advancing the start of the held moves, the arrays are only compacted when they fill up.
+
+    With spill set, once that many moves are held in memory they are appended to temporary files and memory is reused
+    for the following moves. blocks() reads the spilled moves back through a memory map a block at a time, so an episode
+    of any length is held in bounded memory.
+    """
+    def __init__(self, chunk=4096, spill=None, directory=None):
+        """
+        Initialise an empty trajectory, nothing is allocated until the first move
+        :param chunk: the arrays are allocated in multiples of this many moves
+        :param spill: moves held in memory before they are spilled to disk, None to hold every move in memory
+        :param directory: directory for the spill files, default the system temporary directory
+        """
+        self.chunk, self.spill, self.directory = chunk, spill, directory
+        self.start = self.end = 0  # moves held are start to end, states[end] is the new state of the last move
+        self.states = np.zeros(0, dtype=np.int32)  # Q-table row of each state
+        self.actions = np.zeros(0, dtype=np.int8)
+        self.state_view, self.action_view = memoryview(self.states), memoryview(self.actions)
+        self.spilled = 0  # moves in the spill files, they come before the moves held in memory
+        self.state_file = self.action_file = None
+
+    def __len__(self):
+        return self.spilled + self.end - self.start
+
+    def append(self, state, action, new_state):
+        """
+        Add a move.
+        :param state: Q-table row of the state acted from, the new state of the previous move
+        :param action: action taken
+        :param new_state: Q-table row of the state reached
+        """
+        if self.end + 1 >= len(self.states):
+            self.make_room()
+        self.state_view[self.end] = state
+        self.action_view[self.end] = action
+        self.end += 1
+        self.state_view[self.end] = new_state
+
+    def make_room(self):
+        """Make room for another move, spilling the moves in memory or moving them to the front of larger arrays."""
+        if self.spill is not None and self.end - self.start >= self.spill:
+            self.spill_moves()
+        n = self.end - self.start
+        if 2 * (n + 2) > len(self.states):
+            # keep at least half free so appending a long episode copies each move a constant number of times on average
+            capacity = -(-2 * (n + 2) // self.chunk) * self.chunk
+            if self.spill is not None:
+                capacity = min(capacity, -(-(self.spill + 1) // self.chunk) * self.chunk)
+            states, actions = np.zeros(capacity, dtype=np.int32), np.zeros(capacity, dtype=np.int8)
+        else:
+            states, actions = self.states, self.actions
+        if len(self.states):
+            states[:n + 1] = self.states[self.start:self.end + 1]
+            actions[:n] = self.actions[self.start:self.end]
+        self.states, self.actions, self.start, self.end = states, actions, 0, n
+        self.state_view, self.action_view = memoryview(states), memoryview(actions)
+
+    def spill_moves(self):
+        """Append the moves held in memory to the spill files, only the new state of the last move is kept."""
+        self.open_spill_files()
+        self.state_file.write(self.states[self.start:self.end].tobytes())
+        self.action_file.write(self.actions[self.start:self.end].tobytes())
+        self.spilled += self.end - self.start
+        self.start = self.end
+
+    def open_spill_files(self):
+        """Create the spill files if not yet created, they are deleted when closed."""
+        if self.state_file is None:
+            self.state_file = tempfile.TemporaryFile(prefix="states_", dir=self.directory)
+            self.action_file = tempfile.TemporaryFile(prefix="actions_", dir=self.directory)
+
+    def blocks(self, stop=None, block=None):
+        """
+        Memoryviews of the moves from the last to the first a block at a time, indexing them is much faster than numpy
+        scalars. The moves held in memory are not copied.
+        :param stop: only the first stop moves, default every move
+        :param block: moves read back from the spill files at a time, default spill
+        :return: generator of (states, actions) where move i of the block is (states[i], actions[i], states[i + 1])
+        """
+        stop = len(self) if stop is None else stop
+        if stop > self.spilled:
+            end = self.start + stop - self.spilled
+            yield self.state_view[self.start:end + 1], self.action_view[self.start:end]
+        if not self.spilled or not stop:
+            return
+
+        self.state_file.flush()
+        self.action_file.flush()
+        states = np.memmap(self.state_file, dtype=np.int32, mode='r', shape=(self.spilled,))
+        actions = np.memmap(self.action_file, dtype=np.int8, mode='r', shape=(self.spilled,))
+        block = block or self.spill
+        high = min(stop, self.spilled)
+        while high > 0:
+            low = max(high - block, 0)
+            next_state = states[high] if high < self.spilled else self.states[self.start]
+            yield memoryview(np.append(states[low:high], next_state)), memoryview(np.array(actions[low:high]))
+            high = low
+
+    def nbytes(self):
+        """Bytes held by the moves in memory and spilled to disk."""
+        return self.states.nbytes + self.actions.nbytes + self.spilled * (self.states.itemsize + self.actions.itemsize)
+
+    def last_state(self):
+        """Q-table row of the new state of the last move."""
+        return self.state_view[self.end]
+
+    def drop(self, moves):
+        """
+        Drop moves from the front, only moves held in memory can be dropped.
+        :param moves: number of moves to drop
+        """
+        if self.spilled:
+            raise ValueError("Moves spilled to disk can't be dropped")
+        self.start = min(self.start + moves, self.end)
+
+    def clear(self):
+        """Drop every move, keeping the arrays and spill files for the next episode."""
+        self.start = self.end = self.spilled = 0
+        for f in (self.state_file, self.action_file):
+            if f is not None:
+                f.seek(0)
+                f.truncate()
+
+    def copy(self):
+        """Copy of the moves, only as large as it needs to be."""
+        trajectory = Trajectory(self.chunk, self.spill, self.directory)
+        trajectory.states = self.states[self.start:self.end + 1].copy()
+        trajectory.actions = self.actions[self.start:self.end].copy()
+        trajectory.state_view, trajectory.action_view = memoryview(trajectory.states), memoryview(trajectory.actions)
+        trajectory.end = self.end - self.start
+        if self.spilled:
+            trajectory.open_spill_files()
+            for source, destination in ((self.state_file, trajectory.state_file),
+                                        (self.action_file, trajectory.action_file)):
+                source.flush()
+                source.seek(0)
+                shutil.copyfileobj(source, destination)
+            trajectory.spilled = self.spilled
+        return trajectory